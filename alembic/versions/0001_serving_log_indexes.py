@@ -0,0 +1,45 @@
+"""Add serving log and recipe line indexes
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index name, table, columns)
+INDEXES = [
+    ("ix_serving_logs_timestamp_id", "serving_logs", ["timestamp", "id"]),
+    ("ix_serving_logs_status_timestamp", "serving_logs", ["status", "timestamp"]),
+    ("ix_serving_logs_meal_id_timestamp", "serving_logs", ["meal_id", "timestamp"]),
+    ("ix_meal_ingredients_meal_id", "meal_ingredients", ["meal_id"]),
+    ("ix_meal_ingredients_ingredient_id", "meal_ingredients", ["ingredient_id"]),
+]
+
+
+def _existing_indexes(table: str) -> set:
+    inspector = sa.inspect(op.get_bind())
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    # Tables created by Base.metadata.create_all() on a fresh database already have these
+    for name, table, columns in INDEXES:
+        if name not in _existing_indexes(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, _ in reversed(INDEXES):
+        if name in _existing_indexes(table):
+            op.drop_index(name, table_name=table)
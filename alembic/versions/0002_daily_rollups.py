@@ -0,0 +1,49 @@
+"""Add daily ingredient usage and meal portions rollups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 10:00:00.000000
+
+Fill the new tables afterwards with: python backfill_rollups.py
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    # Base.metadata.create_all() may already have created them
+    if not inspector.has_table("daily_ingredient_usage"):
+        op.create_table(
+            "daily_ingredient_usage",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("day", sa.Date(), nullable=False),
+            sa.Column("ingredient_id", sa.Integer(), sa.ForeignKey("ingredients.id"), nullable=False),
+            sa.Column("quantity", sa.Float(), nullable=False),
+            sa.UniqueConstraint("day", "ingredient_id", name="uq_daily_ingredient_usage_day_ingredient"),
+        )
+        op.create_index("ix_daily_ingredient_usage_id", "daily_ingredient_usage", ["id"])
+    if not inspector.has_table("daily_meal_portions"):
+        op.create_table(
+            "daily_meal_portions",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("day", sa.Date(), nullable=False),
+            sa.Column("meal_id", sa.Integer(), sa.ForeignKey("meals.id"), nullable=False),
+            sa.Column("portions", sa.Integer(), nullable=False),
+            sa.UniqueConstraint("day", "meal_id", name="uq_daily_meal_portions_day_meal"),
+        )
+        op.create_index("ix_daily_meal_portions_id", "daily_meal_portions", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("daily_meal_portions")
+    op.drop_table("daily_ingredient_usage")
@@ -0,0 +1,40 @@
+"""Snapshot ingredients consumed by each serving
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Base.metadata.create_all() may already have created it
+    if sa.inspect(op.get_bind()).has_table("serving_log_ingredients"):
+        return
+    op.create_table(
+        "serving_log_ingredients",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("serving_log_id", sa.Integer(), sa.ForeignKey("serving_logs.id"), nullable=False),
+        sa.Column("ingredient_id", sa.Integer(), sa.ForeignKey("ingredients.id"), nullable=False),
+        sa.Column("quantity", sa.Float(), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_serving_log_ingredients_id", "serving_log_ingredients", ["id"])
+    op.create_index("ix_serving_log_ingredients_serving_log_id", "serving_log_ingredients", ["serving_log_id"])
+    op.create_index("ix_serving_log_ingredients_timestamp_ingredient", "serving_log_ingredients",
+                    ["timestamp", "ingredient_id"])
+
+
+def downgrade() -> None:
+    op.drop_table("serving_log_ingredients")
@@ -0,0 +1,45 @@
+"""Delete daily rollup rows along with their ingredient or meal
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column, referred table)
+FOREIGN_KEYS = [
+    ("daily_ingredient_usage", "ingredient_id", "ingredients"),
+    ("daily_meal_portions", "meal_id", "meals"),
+]
+
+
+def _replace_foreign_keys(ondelete: Union[str, None]) -> None:
+    bind = op.get_bind()
+    # SQLite cannot alter constraints; the app deletes these rows itself there
+    if bind.dialect.name == "sqlite":
+        return
+    inspector = sa.inspect(bind)
+    for table, column, referred in FOREIGN_KEYS:
+        for foreign_key in inspector.get_foreign_keys(table):
+            if foreign_key["constrained_columns"] == [column] and foreign_key["name"]:
+                op.drop_constraint(foreign_key["name"], table, type_="foreignkey")
+        op.create_foreign_key(f"fk_{table}_{column}", table, referred, [column], ["id"], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    _replace_foreign_keys("CASCADE")
+
+
+def downgrade() -> None:
+    _replace_foreign_keys(None)
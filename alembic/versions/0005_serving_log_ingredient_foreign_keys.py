@@ -0,0 +1,45 @@
+"""Delete consumed ingredient snapshots along with their serving or ingredient
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column, referred table)
+FOREIGN_KEYS = [
+    ("serving_log_ingredients", "serving_log_id", "serving_logs"),
+    ("serving_log_ingredients", "ingredient_id", "ingredients"),
+]
+
+
+def _replace_foreign_keys(ondelete: Union[str, None]) -> None:
+    bind = op.get_bind()
+    # SQLite cannot alter constraints; the app deletes these rows itself there
+    if bind.dialect.name == "sqlite":
+        return
+    inspector = sa.inspect(bind)
+    for table, column, referred in FOREIGN_KEYS:
+        for foreign_key in inspector.get_foreign_keys(table):
+            if foreign_key["constrained_columns"] == [column] and foreign_key["name"]:
+                op.drop_constraint(foreign_key["name"], table, type_="foreignkey")
+        op.create_foreign_key(f"fk_{table}_{column}", table, referred, [column], ["id"], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    _replace_foreign_keys("CASCADE")
+
+
+def downgrade() -> None:
+    _replace_foreign_keys(None)
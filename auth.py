@@ -1,81 +1,279 @@
 # auth.py
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from database import SessionLocal
-from models import User
+from database import ThreadpoolSession, get_async_db, get_db
+from models import User, UserRole
+from schemas import UserResponse
+from cache import auth_cache, user_namespace, AUTH_CACHE_URL
+import asyncio
 import os
+import threading
+import time
+import uuid
 
 # Security settings
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Refresh tokens let clients get new access tokens without the password
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+# Set to redis://host:6379/0 to share revoked refresh tokens between workers
+TOKEN_REVOCATION_URL = os.getenv("TOKEN_REVOCATION_URL", AUTH_CACHE_URL)
+
+# bcrypt cost factor; stored hashes with a different cost are rehashed on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt runs on its own bounded pool so it never blocks the event loop or starves the request threads
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+# Logins beyond this many in flight wait up to LOGIN_QUEUE_TIMEOUT seconds, then get a 429
+LOGIN_CONCURRENCY = int(os.getenv("LOGIN_CONCURRENCY", str(PASSWORD_HASH_WORKERS * 2)))
+LOGIN_QUEUE_TIMEOUT = float(os.getenv("LOGIN_QUEUE_TIMEOUT", "5"))
 
 # Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+login_slots = asyncio.Semaphore(LOGIN_CONCURRENCY)
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Dependency to get the database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # Password verification
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_executor.submit(pwd_context.verify, plain_password, hashed_password).result()
 
 # Password hashing
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_executor.submit(pwd_context.hash, password).result()
+
+# Password verification for async code; also returns a new hash when the stored one needs rehashing
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.verify_and_update,
+                                      plain_password, hashed_password)
 
 # Get user by email
 def get_user_by_email(db: Session, email: str) -> Optional[User]:
     # noinspection PyTypeChecker
     return db.query(User).filter(User.email == email).first()
 
+# Limit concurrent logins so a login storm queues instead of saturating the bcrypt pool
+@asynccontextmanager
+async def login_slot():
+    try:
+        await asyncio.wait_for(login_slots.acquire(), LOGIN_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many logins in progress, please retry",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        yield
+    finally:
+        login_slots.release()
+
 # Authenticate user
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-    user = get_user_by_email(db, email)
-    if not user or not verify_password(password, user.hashed_password):
-        return None
-    user.last_login = datetime.now(timezone.utc)
-    db.commit()
-    return user
+async def authenticate_user(db: AsyncSession | ThreadpoolSession, email: str, password: str) -> Optional[User]:
+    """Check the credentials without blocking the event loop and record the login.
+
+    Database work is awaited through the async session and bcrypt runs on password_executor.
+    A hash made with a different BCRYPT_ROUNDS is replaced in the same commit as last_login.
+    """
+    async with login_slot():
+        user = await db.run_sync(get_user_by_email, email)
+        if not user:
+            return None
+        valid, new_hash = await verify_and_update_password(password, user.hashed_password)
+        if not valid:
+            return None
+
+        def record_login(session: Session):
+            if new_hash:
+                user.hashed_password = new_hash
+            user.last_login = datetime.now(timezone.utc)
+            session.commit()
+            # Reload now so building the response does not hit the database on the event loop
+            session.refresh(user)
+
+        await db.run_sync(record_login)
+        return user
+
+# Claims identifying a user in their access tokens
+def user_claims(user: User | UserResponse) -> dict:
+    return {"sub": user.email, "uid": user.id, "role": UserRole(user.role).value}
+
+# Sign a token of the given type
+def _encode_token(data: dict, token_type: str, expires_delta: timedelta) -> str:
+    to_encode = data.copy()
+    issued_at = datetime.now(timezone.utc)
+    to_encode.update({"type": token_type, "exp": issued_at + expires_delta, "iat": issued_at})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 # Create JWT access token
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
-    to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=15))
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return _encode_token(data, "access", expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
 
-# Get current user from token
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    credentials_exception = HTTPException(
+# Create a single-use refresh token; its jti is revoked when it is exchanged
+def create_refresh_token(user: User | UserResponse) -> str:
+    data = {"sub": user.email, "uid": user.id, "jti": uuid.uuid4().hex}
+    return _encode_token(data, "refresh", timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+# Verify a token's signature, expiry and type, and return its claims
+def decode_token(token: str, token_type: str = "access") -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    # Tokens issued before the type claim are access tokens
+    if payload.get("sub") is None or payload.get("type", "access") != token_type:
+        raise _credentials_exception()
+    return payload
+
+
+class MemoryRevocationList:
+    """Revoked token ids held in process until the tokens would have expired anyway."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.expires_at: Dict[str, float] = {}
+        self.prune_at = 1024
 
-    user = get_user_by_email(db, email=email)
+    def revoke(self, jti: str, expires_at: float) -> bool:
+        """Revoke a token id; False if it was already revoked."""
+        now = time.time()
+        with self.lock:
+            if len(self.expires_at) >= self.prune_at:
+                self.expires_at = {key: value for key, value in self.expires_at.items() if value > now}
+                self.prune_at = max(1024, len(self.expires_at) * 2)
+            if jti in self.expires_at:
+                return False
+            self.expires_at[jti] = expires_at
+            return True
+
+
+class RedisRevocationList:
+    """Revoked token ids shared by all workers, each key expiring with its token."""
+
+    def __init__(self, url: str, prefix: str = "kindergarten:revoked:", client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def revoke(self, jti: str, expires_at: float) -> bool:
+        ttl = max(int(expires_at - time.time()), 1)
+        return bool(self.client.set(self.prefix + jti, 1, ex=ttl, nx=True))
+
+
+revoked_tokens = RedisRevocationList(TOKEN_REVOCATION_URL) if TOKEN_REVOCATION_URL else MemoryRevocationList()
+
+# Exchange a refresh token for a new access and refresh token
+def refresh_tokens(db: Session, refresh_token: str) -> Tuple[UserResponse, str, str]:
+    """Rotate a refresh token without bcrypt or a last_login write.
+
+    Each refresh token works once, so a replayed one is rejected. Claims come from the
+    current user row, so role changes and deletions apply at the next refresh.
+    """
+    payload = decode_token(refresh_token, "refresh")
+    if not revoked_tokens.revoke(payload["jti"], payload["exp"]):
+        raise _credentials_exception()
+    user = _load_user(db, payload["sub"], payload.get("uid"))
+    if user is None:
+        raise _credentials_exception()
+    return user, create_access_token(user_claims(user)), create_refresh_token(user)
+
+# Cache values must be plain JSON for the Redis backend
+def _snapshot(user: Optional[UserResponse]) -> Optional[dict]:
+    return user.model_dump(mode="json") if user is not None else None
+
+# Load the user a token names, as the snapshot cached for the token
+def _load_user(db: Session, email: str, user_id: Optional[int]) -> Optional[UserResponse]:
+    if user_id is None:
+        user = get_user_by_email(db, email=email)
+    else:
+        user = db.get(User, user_id)
+    # A changed email invalidates the tokens issued for the old one
+    if user is None or user.email != email:
+        return None
+    return UserResponse.model_validate(user)
+
+# Get current user from token
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> UserResponse:
+    """Resolve the token's user, from the auth cache when this token was seen recently.
+
+    Entries are keyed by subject and issue time and live for AUTH_CACHE_TTL seconds;
+    update_user_db and delete_user_db drop a user's entries immediately.
+    """
+    payload = decode_token(token)
+    email = payload["sub"]
+    user_id = payload.get("uid")
+    if user_id is None:
+        # Tokens issued before the uid claim are looked up every time until they expire
+        user = _load_user(db, email, None)
+    else:
+        cached = auth_cache.get_or_compute(
+            user_namespace(user_id), (email, payload.get("iat")),
+            lambda: _snapshot(_load_user(db, email, user_id))
+        )
+        user = UserResponse.model_validate(cached) if cached is not None else None
+    if user is None:
+        raise _credentials_exception()
+    return user
+
+# Get current user from token, for async endpoints
+async def get_current_user_async(token: str = Depends(oauth2_scheme),
+                                 db: AsyncSession | ThreadpoolSession = Depends(get_async_db)) -> UserResponse:
+    """get_current_user without a sync session: a cache miss loads the user through the
+    endpoint's async session, so the request still uses one session."""
+    payload = decode_token(token)
+    email = payload["sub"]
+    user_id = payload.get("uid")
+    if user_id is None:
+        user = await db.run_sync(_load_user, email, None)
+    else:
+        async def load():
+            return _snapshot(await db.run_sync(_load_user, email, user_id))
+
+        cached = await auth_cache.get_or_compute_async(user_namespace(user_id), (email, payload.get("iat")), load)
+        user = UserResponse.model_validate(cached) if cached is not None else None
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    return user
+
+def _check_role(user: UserResponse, roles: tuple[str, ...]) -> UserResponse:
+    if user.role.value not in roles:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
     return user
+
+# Dependency factory for role checks against the user's current role
+def require_roles(*roles: str) -> Callable[..., UserResponse]:
+    """Allow only users whose role is one of roles.
+
+    The role comes from the cached user snapshot rather than the token's role claim, so
+    demoting or deleting a user takes effect on their next request.
+    """
+    def check_roles(current_user: UserResponse = Depends(get_current_user)) -> UserResponse:
+        return _check_role(current_user, roles)
+    return check_roles
+
+# require_roles for async endpoints, which must not open a sync session
+def require_roles_async(*roles: str) -> Callable[..., Awaitable[UserResponse]]:
+    async def check_roles(current_user: UserResponse = Depends(get_current_user_async)) -> UserResponse:
+        return _check_role(current_user, roles)
+    return check_roles
@@ -0,0 +1,23 @@
+# backfill_rollups.py
+"""Rebuild the daily analytics rollups from the serving history.
+
+Run once after migrating an existing database, or any time the rollups look off:
+
+    python backfill_rollups.py
+"""
+from database import SessionLocal
+from crud import rebuild_daily_rollups
+
+
+def main():
+    db = SessionLocal()
+    try:
+        counts = rebuild_daily_rollups(db_session=db)
+    finally:
+        db.close()
+    for table, rows in counts.items():
+        print(f"{table}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# backplane.py
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+# Set to redis://host:6379/0 to share WebSocket events between uvicorn workers
+WS_BACKPLANE_URL = os.getenv("WS_BACKPLANE_URL", "")
+WS_BACKPLANE_CHANNEL = os.getenv("WS_BACKPLANE_CHANNEL", "kindergarten:ws")
+
+logger = logging.getLogger(__name__)
+
+EnvelopeHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class BackplaneUnavailable(Exception):
+    """The shared sequence counter cannot be reached; the caller should retry later."""
+
+
+class Backplane(ABC):
+    """Carries published events to the ConnectionManager of every worker.
+
+    An envelope is {"topics": [...], "message": "<serialized event>"}. Every worker,
+    including the publishing one, receives it through the handler passed to start().
+    """
+
+    @abstractmethod
+    async def start(self, handler: EnvelopeHandler):
+        """Begin delivering envelopes to handler."""
+
+    @abstractmethod
+    async def publish(self, envelope: Dict[str, Any]):
+        """Deliver an envelope to the handler of every worker."""
+
+    @abstractmethod
+    async def next_sequence(self) -> int:
+        """Allocate the next delta sequence number, shared by all workers.
+
+        Raises BackplaneUnavailable when the shared counter cannot be reached.
+        """
+
+    @abstractmethod
+    async def current_sequence(self) -> int:
+        """The last sequence number allocated; raises BackplaneUnavailable like next_sequence."""
+
+    @abstractmethod
+    async def close(self):
+        """Stop delivering and release connections."""
+
+
+class InProcessBackplane(Backplane):
+    """Delivers envelopes straight back to the local manager (single worker)."""
+
+    def __init__(self):
+        self.handler: Optional[EnvelopeHandler] = None
+        self.sequence = 0
+
+    async def start(self, handler: EnvelopeHandler):
+        self.handler = handler
+
+    async def publish(self, envelope: Dict[str, Any]):
+        if self.handler is not None:
+            await self.handler(envelope)
+
+    async def next_sequence(self) -> int:
+        self.sequence += 1
+        return self.sequence
+
+    async def current_sequence(self) -> int:
+        return self.sequence
+
+    async def close(self):
+        self.handler = None
+
+
+class RedisBackplane(Backplane):
+    """Fans envelopes out to every worker through a Redis pub/sub channel.
+
+    The publishing worker delivers to its own sockets immediately and skips its own
+    echo from Redis, so local clients never wait on the round-trip.
+    """
+
+    def __init__(self, url: str = WS_BACKPLANE_URL, channel: str = WS_BACKPLANE_CHANNEL, client=None):
+        self.url = url
+        self.channel = channel
+        self.sequence_key = f"{channel}:seq"
+        self.origin = uuid.uuid4().hex
+        self.client = client
+        self.handler: Optional[EnvelopeHandler] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, handler: EnvelopeHandler):
+        if self.client is None:
+            self.client = redis.from_url(self.url)
+        self.handler = handler
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub):
+        try:
+            while True:
+                try:
+                    message = await pubsub.get_message(timeout=1.0)
+                except (RedisError, OSError) as exc:
+                    logger.warning("Backplane connection lost (%s), retrying", exc)
+                    await asyncio.sleep(1)
+                    continue
+                if message is None:
+                    continue
+                try:
+                    envelope = json.loads(message["data"])
+                    if envelope.pop("origin", None) != self.origin:
+                        await self.handler(envelope)
+                except Exception:
+                    logger.exception("Failed to deliver backplane message")
+        finally:
+            await pubsub.aclose()
+
+    async def publish(self, envelope: Dict[str, Any]):
+        await self.handler(envelope)
+        try:
+            await self.client.publish(self.channel, json.dumps({**envelope, "origin": self.origin}))
+        except (RedisError, OSError) as exc:
+            # Publishing follows a committed write; failing the request would make clients retry it
+            logger.warning("Backplane publish failed, other workers miss this event (%s)", exc)
+
+    async def next_sequence(self) -> int:
+        try:
+            return int(await self.client.incr(self.sequence_key))
+        except (RedisError, OSError) as exc:
+            # A local counter would hand out numbers other workers also use, so callers retry instead
+            logger.warning("Backplane could not allocate a sequence number (%s)", exc)
+            raise BackplaneUnavailable() from exc
+
+    async def current_sequence(self) -> int:
+        try:
+            return int(await self.client.get(self.sequence_key) or 0)
+        except (RedisError, OSError) as exc:
+            logger.warning("Backplane could not read the sequence number (%s)", exc)
+            raise BackplaneUnavailable() from exc
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self.client is not None:
+            await self.client.aclose()
+
+
+def create_backplane(url: str = WS_BACKPLANE_URL) -> Backplane:
+    """Pick the backplane from the configured URL; no URL means a single in-process worker."""
+    if not url:
+        return InProcessBackplane()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackplane(url)
+    raise ValueError(f"Unsupported WS_BACKPLANE_URL scheme: {url}")
@@ -0,0 +1,219 @@
+# cache.py
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import asyncio
+import json
+import os
+import threading
+import time
+
+# Analytics results are cached per endpoint and parameters until a write invalidates them
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "30"))
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", "256"))
+# Set to redis://host:6379/0 to share the cache between workers
+ANALYTICS_CACHE_URL = os.getenv("ANALYTICS_CACHE_URL", "")
+# Verified token identities are cached briefly; user updates and deletes invalidate them
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_CACHE_URL = os.getenv("AUTH_CACHE_URL", ANALYTICS_CACHE_URL)
+# How long a request waits for another request computing the same key
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("CACHE_SINGLE_FLIGHT_TIMEOUT", "30"))
+
+ANALYTICS_NAMESPACE = "analytics"
+
+
+def user_namespace(user_id: int) -> str:
+    """Namespace of the cached identities of one user."""
+    return f"auth:{user_id}"
+
+
+_MISSING = object()
+# Invalidations held back by deferred_invalidations() in the current context
+_deferred: ContextVar[Optional[list]] = ContextVar("deferred_invalidations", default=None)
+
+
+class MemoryCacheBackend:
+    """In-process store with a TTL per entry and least-recently-used eviction."""
+
+    # Calls return immediately, so async code may make them on the event loop
+    blocking = False
+
+    def __init__(self, max_entries: int = ANALYTICS_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.generations: Dict[str, int] = {}
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return _MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def generation(self, namespace: str) -> int:
+        with self.lock:
+            return self.generations.get(namespace, 0)
+
+    def bump_generation(self, namespace: str):
+        with self.lock:
+            self.generations[namespace] = self.generations.get(namespace, 0) + 1
+            # Entries of older generations can never be read again
+            prefix = f"{namespace}:"
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+
+class RedisCacheBackend:
+    """Redis store shared by all workers; values are stored as JSON and evicted by Redis itself."""
+
+    # Calls wait on the network, so async code makes them in a worker thread
+    blocking = True
+
+    def __init__(self, url: str = ANALYTICS_CACHE_URL, prefix: str = "kindergarten:cache:", client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Any:
+        raw = self.client.get(self.prefix + key)
+        return _MISSING if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.client.set(self.prefix + key, json.dumps(value, default=str), px=int(ttl * 1000))
+
+    def generation(self, namespace: str) -> int:
+        return int(self.client.get(f"{self.prefix}{namespace}:generation") or 0)
+
+    def bump_generation(self, namespace: str):
+        self.client.incr(f"{self.prefix}{namespace}:generation")
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = _MISSING
+
+
+class Cache:
+    """Read-through cache with namespace invalidation and single-flight recomputation.
+
+    Keys live under a namespace generation; invalidate() bumps the generation so every
+    key in the namespace misses at once, including on other workers with the Redis backend.
+    Concurrent misses for the same key wait for the first caller instead of recomputing.
+    """
+
+    def __init__(self, backend, default_ttl: float = ANALYTICS_CACHE_TTL):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, _Flight] = {}
+
+    def _lookup(self, namespace: str, key: Tuple[Hashable, ...]) -> Tuple[str, Any]:
+        full_key = f"{namespace}:{self.backend.generation(namespace)}:{':'.join(map(str, key))}"
+        return full_key, self.backend.get(full_key)
+
+    async def _call(self, function: Callable[..., Any], *args) -> Any:
+        if self.backend.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    def get_or_compute(self, namespace: str, key: Tuple[Hashable, ...], compute: Callable[[], Any],
+                       ttl: Optional[float] = None) -> Any:
+        full_key, value = self._lookup(namespace, key)
+        if value is not _MISSING:
+            return value
+
+        with self.lock:
+            flight = self.in_flight.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[full_key] = _Flight()
+        if not leader:
+            flight.done.wait(SINGLE_FLIGHT_TIMEOUT)
+            if flight.value is not _MISSING:
+                return flight.value
+            # The leader failed or is too slow, compute our own result
+            return compute()
+
+        try:
+            value = compute()
+            # Stored under the generation read before computing, so a write that lands
+            # meanwhile still invalidates this result
+            self.backend.set(full_key, value, ttl or self.default_ttl)
+            flight.value = value
+            return value
+        finally:
+            with self.lock:
+                self.in_flight.pop(full_key, None)
+            flight.done.set()
+
+    async def get_or_compute_async(self, namespace: str, key: Tuple[Hashable, ...],
+                                   compute: Callable[[], Awaitable[Any]], ttl: Optional[float] = None) -> Any:
+        """get_or_compute for the event loop: compute is awaited and Redis calls run in a thread.
+
+        Concurrent misses are not coalesced.
+        """
+        full_key, value = await self._call(self._lookup, namespace, key)
+        if value is not _MISSING:
+            return value
+        value = await compute()
+        await self._call(self.backend.set, full_key, value, ttl or self.default_ttl)
+        return value
+
+    def invalidate(self, namespace: str):
+        deferred = _deferred.get()
+        if deferred is not None and self.backend.blocking:
+            deferred.append((self.backend, namespace))
+            return
+        self.backend.bump_generation(namespace)
+
+
+def _bump_generations(deferred: list):
+    for backend, namespace in deferred:
+        backend.bump_generation(namespace)
+
+
+@asynccontextmanager
+async def deferred_invalidations() -> AsyncIterator[None]:
+    """Hold back invalidations of blocking backends made inside the block, then run them in a thread.
+
+    For sync code that runs on the event loop, such as AsyncSession.run_sync() callbacks.
+    Held invalidations run even when the block raises, since it may have committed first.
+    """
+    deferred = []
+    token = _deferred.set(deferred)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+        if deferred:
+            await asyncio.to_thread(_bump_generations, deferred)
+
+
+def create_cache(url: str = ANALYTICS_CACHE_URL, ttl: float = ANALYTICS_CACHE_TTL,
+                 max_entries: int = ANALYTICS_CACHE_MAX_ENTRIES) -> Cache:
+    """Pick the cache backend from the configured URL; no URL means an in-process cache."""
+    if url:
+        return Cache(RedisCacheBackend(url), ttl)
+    return Cache(MemoryCacheBackend(max_entries), ttl)
+
+
+analytics_cache = create_cache()
+auth_cache = create_cache(AUTH_CACHE_URL, AUTH_CACHE_TTL, AUTH_CACHE_MAX_ENTRIES)
@@ -1,13 +1,59 @@
 # crud.py
 from __future__ import annotations
-from typing import Any, Union, Dict
+from typing import Any, Union, Dict, Iterable, Iterator
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import bindparam, func, desc, case, delete, insert, select, tuple_, union_all, update
 from models import *
 from schemas import *
 from auth import get_password_hash
-from datetime import datetime, timedelta, timezone
+from cache import analytics_cache, auth_cache, deferred_invalidations, user_namespace, ANALYTICS_NAMESPACE
+from datetime import date, datetime, time as dt_time, timedelta, timezone
 from fastapi import HTTPException
+import base64
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+# Max-portions results are recomputed incrementally on writes; the TTL bounds staleness
+# from writes made by other worker processes
+MAX_PORTIONS_CACHE_TTL = float(os.getenv("MAX_PORTIONS_CACHE_TTL", "30"))
+# Serve dashboard stats from in-process counters, rebuilt from the database periodically
+DASHBOARD_LIVE_COUNTERS = os.getenv("DASHBOARD_LIVE_COUNTERS", "false").lower() in ("1", "true", "yes")
+DASHBOARD_RECONCILE_SECONDS = float(os.getenv("DASHBOARD_RECONCILE_SECONDS", "60"))
+# Rows fetched per round trip when streaming reports
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "1000"))
+
+
+# Keyset pagination
+def encode_cursor(*values: Any) -> str:
+    """Pack the sort key of the last row on a page into an opaque cursor token."""
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list[Any]:
+    """Unpack a cursor token produced by encode_cursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def _next_id_cursor(rows: list[Any], limit: int) -> str | None:
+    return encode_cursor(rows[-1].id) if rows and len(rows) == limit else None
+
+
+def _after_id(after: str) -> int:
+    after_id = decode_cursor(after, 1)[0]
+    if not isinstance(after_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return after_id
 
 
 # User CRUD operations
@@ -23,9 +69,15 @@ def get_user_by_email(db_session: Session, email: str) -> User | None:
     return db_session.query(User).filter(User.email == email).first()
 
 
-def get_users(db_session: Session, skip: int = 0, limit: int = 100) -> list[type[User]]:
-    """Get a list of users with pagination."""
-    return db_session.query(User).offset(skip).limit(limit).all()
+def get_users(db_session: Session, skip: int = 0, limit: int = 100,
+              after: str | None = None) -> tuple[list[type[User]], str | None]:
+    """Get a page of users ordered by ID, and the cursor for the next page."""
+    query = db_session.query(User)
+    if after:
+        # noinspection PyTypeChecker
+        query = query.filter(User.id > _after_id(after))
+    users = query.order_by(User.id).offset(skip).limit(limit).all()
+    return users, _next_id_cursor(users, limit)
 
 
 def create_user_db(db_session: Session, user: UserCreate) -> User:
@@ -54,6 +106,7 @@ def update_user_db(db_session: Session, user_id: int, user_update: UserUpdate) -
         db_user.updated_at = datetime.now(timezone.utc)
         db_session.commit()
         db_session.refresh(db_user)
+        auth_cache.invalidate(user_namespace(user_id))
     return db_user
 
 
@@ -64,6 +117,7 @@ def delete_user_db(db_session: Session, user_id: int) -> Dict[str, str]:
     if db_user:
         db_session.delete(db_user)
         db_session.commit()
+        auth_cache.invalidate(user_namespace(user_id))
     return {"message": "User deleted successfully"}
 
 
@@ -74,9 +128,15 @@ def get_ingredient(db_session: Session, ingredient_id: int) -> Ingredient | None
     return db_session.query(Ingredient).filter(Ingredient.id == ingredient_id).first()
 
 
-def get_ingredients(db_session: Session, skip: int = 0, limit: int = 100) -> list[type[Ingredient]]:
-    """Get a list of ingredients with pagination."""
-    return db_session.query(Ingredient).offset(skip).limit(limit).all()
+def get_ingredients(db_session: Session, skip: int = 0, limit: int = 100,
+                    after: str | None = None) -> tuple[list[type[Ingredient]], str | None]:
+    """Get a page of ingredients ordered by ID, and the cursor for the next page."""
+    query = db_session.query(Ingredient)
+    if after:
+        # noinspection PyTypeChecker
+        query = query.filter(Ingredient.id > _after_id(after))
+    ingredients = query.order_by(Ingredient.id).offset(skip).limit(limit).all()
+    return ingredients, _next_id_cursor(ingredients, limit)
 
 
 def create_ingredient_db(db_session: Session, ingredient: IngredientCreate) -> Ingredient:
@@ -85,6 +145,8 @@ def create_ingredient_db(db_session: Session, ingredient: IngredientCreate) -> I
     db_session.add(db_ingredient)
     db_session.commit()
     db_session.refresh(db_ingredient)
+    dashboard_counters.set_ingredient(db_ingredient)
+    analytics_cache.invalidate(ANALYTICS_NAMESPACE)
     return db_ingredient
 
 
@@ -100,6 +162,9 @@ def update_ingredient_db(db_session: Session, ingredient_id: int,
         db_ingredient.updated_at = datetime.now(timezone.utc)
         db_session.commit()
         db_session.refresh(db_ingredient)
+        max_portions_cache.invalidate_ingredients([ingredient_id])
+        dashboard_counters.set_ingredient(db_ingredient)
+        analytics_cache.invalidate(ANALYTICS_NAMESPACE)
     return db_ingredient
 
 
@@ -108,25 +173,227 @@ def delete_ingredient_db(db_session: Session, ingredient_id: int) -> Dict[str, s
     # noinspection PyTypeChecker
     db_ingredient = db_session.query(Ingredient).filter(Ingredient.id == ingredient_id).first()
     if db_ingredient:
+        # The foreign key cascades too, but SQLite only enforces it with PRAGMA foreign_keys
+        # noinspection PyTypeChecker
+        db_session.query(DailyIngredientUsage).filter(DailyIngredientUsage.ingredient_id == ingredient_id).delete()
+        # noinspection PyTypeChecker
+        db_session.query(ServingLogIngredient).filter(ServingLogIngredient.ingredient_id == ingredient_id).delete()
         db_session.delete(db_ingredient)
         db_session.commit()
+        max_portions_cache.invalidate_ingredients([ingredient_id])
+        dashboard_counters.remove_ingredient(ingredient_id)
+        analytics_cache.invalidate(ANALYTICS_NAMESPACE)
     return {"message": "Ingredient deleted successfully"}
 
 
+RESTOCK_FIELDS = ("unit", "threshold", "category", "cost")
+
+
+def restock_ingredients_db(db_session: Session,
+                           lines: list[IngredientRestock]) -> tuple[list[Ingredient], list[Ingredient]]:
+    """Apply a delivery in one transaction, matching ingredients by name.
+
+    Lines for the same name are summed. Existing ingredients get quantity += delivered with one
+    executemany UPDATE; unknown names are bulk inserted and need unit, threshold, category and cost.
+    Where several ingredients share a name, the oldest one is restocked.
+    Returns the created and the updated ingredients.
+    """
+    deliveries: Dict[str, Dict[str, Any]] = {}
+    for line in lines:
+        name = line.name.strip()
+        delivery = deliveries.setdefault(name, {"name": name, "quantity": 0.0})
+        delivery["quantity"] += line.quantity
+        # Later lines win for the descriptive fields
+        delivery.update(line.model_dump(include={*RESTOCK_FIELDS, "delivery_date"}, exclude_none=True))
+    if not deliveries:
+        return [], []
+
+    # noinspection PyTypeChecker
+    existing = dict(
+        db_session.query(Ingredient.name, func.min(Ingredient.id))
+        .filter(Ingredient.name.in_(deliveries))
+        .group_by(Ingredient.name).all()
+    )
+    new_rows = [delivery for name, delivery in deliveries.items() if name not in existing]
+    incomplete = [row["name"] for row in new_rows if any(field not in row for field in RESTOCK_FIELDS)]
+    if incomplete:
+        raise HTTPException(
+            status_code=400,
+            detail=f"New ingredients need {', '.join(RESTOCK_FIELDS)}: {', '.join(incomplete)}"
+        )
+
+    now = datetime.now(timezone.utc)
+    if existing:
+        table = Ingredient.__table__
+        # One statement for every line; fields a line leaves out keep their stored value
+        statement = update(table).where(table.c.id == bindparam("ingredient_id")).values(
+            quantity=table.c.quantity + bindparam("delivered"),
+            delivery_date=bindparam("delivered_at"),
+            updated_at=now,
+            **{field: func.coalesce(bindparam(f"new_{field}"), table.c[field]) for field in RESTOCK_FIELDS}
+        )
+        db_session.execute(statement, [
+            {
+                "ingredient_id": existing[name],
+                "delivered": delivery["quantity"],
+                "delivered_at": delivery.get("delivery_date", now),
+                **{f"new_{field}": delivery.get(field) for field in RESTOCK_FIELDS}
+            }
+            for name, delivery in deliveries.items() if name in existing
+        ])
+    if new_rows:
+        db_session.execute(
+            insert(Ingredient),
+            [{"delivery_date": now, **row, "created_at": now, "updated_at": now} for row in new_rows]
+        )
+    db_session.commit()
+
+    ingredients: Dict[str, Ingredient] = {}
+    # noinspection PyTypeChecker
+    for ingredient in db_session.query(Ingredient).filter(Ingredient.name.in_(deliveries)).order_by(Ingredient.id):
+        ingredients.setdefault(ingredient.name, ingredient)
+    max_portions_cache.invalidate_ingredients(existing.values())
+    for ingredient in ingredients.values():
+        dashboard_counters.set_ingredient(ingredient)
+    analytics_cache.invalidate(ANALYTICS_NAMESPACE)
+    return ([ingredient for name, ingredient in ingredients.items() if name not in existing],
+            [ingredient for name, ingredient in ingredients.items() if name in existing])
+
+
+def get_ingredient_levels(db_session: Session,
+                          ingredient_ids: list[int] | None = None) -> list[tuple[int, float, float]]:
+    """Get (id, quantity, threshold) for every ingredient, or for the given ones."""
+    query = db_session.query(Ingredient.id, Ingredient.quantity, Ingredient.threshold)
+    if ingredient_ids is not None:
+        # noinspection PyTypeChecker
+        query = query.filter(Ingredient.id.in_(ingredient_ids))
+    return [(row.id, row.quantity, row.threshold) for row in query.order_by(Ingredient.id).all()]
+
+
 # Meal CRUD operations
-def get_meal(db_session: Session, meal_id: int) -> Meal | None:
-    """Get a meal by its ID."""
+def _build_meal_responses(db_session: Session, meals: list[Any]) -> list[MealResponse]:
+    """Attach recipe lines and ingredient names to meal rows with a single query."""
+    meal_ids = [meal.id for meal in meals]
+    lines_by_meal: Dict[int, list[MealIngredientResponse]] = {meal_id: [] for meal_id in meal_ids}
+    if meal_ids:
+        # noinspection PyTypeChecker
+        lines = db_session.query(
+            MealIngredient.id,
+            MealIngredient.meal_id,
+            MealIngredient.ingredient_id,
+            MealIngredient.quantity,
+            MealIngredient.unit,
+            Ingredient.name.label("ingredient_name")
+        ).join(Ingredient, Ingredient.id == MealIngredient.ingredient_id) \
+            .filter(MealIngredient.meal_id.in_(meal_ids)) \
+            .order_by(MealIngredient.id).all()
+        for line in lines:
+            lines_by_meal[line.meal_id].append(MealIngredientResponse(
+                id=line.id,
+                ingredient_id=line.ingredient_id,
+                quantity=line.quantity,
+                unit=line.unit,
+                ingredient_name=line.ingredient_name
+            ))
+
+    return [
+        MealResponse(
+            id=meal.id,
+            name=meal.name,
+            description=meal.description,
+            category=meal.category,
+            servings=meal.servings,
+            preparation_time=meal.preparation_time,
+            created_at=meal.created_at,
+            ingredients=lines_by_meal[meal.id]
+        )
+        for meal in meals
+    ]
+
+
+def _meal_rows_query(db_session: Session):
+    return db_session.query(
+        Meal.id, Meal.name, Meal.description, Meal.category,
+        Meal.servings, Meal.preparation_time, Meal.created_at
+    )
+
+
+def get_meal(db_session: Session, meal_id: int) -> MealResponse | None:
+    """Get a meal by its ID, with its recipe lines."""
     # noinspection PyTypeChecker
-    return db_session.query(Meal).filter(Meal.id == meal_id).first()
+    meal = _meal_rows_query(db_session).filter(Meal.id == meal_id).first()
+    if meal is None:
+        return None
+    return _build_meal_responses(db_session, [meal])[0]
+
+
+def get_meals(db_session: Session, skip: int = 0, limit: int = 100,
+              after: str | None = None) -> tuple[list[MealResponse], str | None]:
+    """Get a page of meals with their recipe lines, and the cursor for the next page.
+
+    The whole page costs two queries.
+    """
+    query = _meal_rows_query(db_session)
+    if after:
+        # noinspection PyTypeChecker
+        query = query.filter(Meal.id > _after_id(after))
+    meals = query.order_by(Meal.id).offset(skip).limit(limit).all()
+    return _build_meal_responses(db_session, meals), _next_id_cursor(meals, limit)
+
+
+def _merge_recipe_lines(lines: list[MealIngredientBase]) -> Dict[int, tuple[float, str]]:
+    """Key recipe lines by ingredient; repeated ingredients are summed and the last unit wins."""
+    merged: Dict[int, tuple[float, str]] = {}
+    for line in lines:
+        quantity = merged[line.ingredient_id][0] if line.ingredient_id in merged else 0.0
+        merged[line.ingredient_id] = (quantity + line.quantity, line.unit)
+    return merged
 
 
-def get_meals(db_session: Session, skip: int = 0, limit: int = 100) -> list[type[Meal]]:
-    """Get a list of meals with pagination."""
-    return db_session.query(Meal).offset(skip).limit(limit).all()
+def _write_recipe(db_session: Session, meal_id: int, lines: list[MealIngredientBase]) -> bool:
+    """Bring the recipe of a meal in line with `lines` without committing.
 
+    The stored lines are diffed against the new ones by ingredient_id, so unchanged lines keep
+    their rows and ids; the changes are applied with at most one DELETE, one executemany UPDATE
+    and one bulk INSERT. Returns whether any line changed.
+    """
+    wanted = _merge_recipe_lines(lines)
+    # noinspection PyTypeChecker
+    current = db_session.query(
+        MealIngredient.id, MealIngredient.ingredient_id, MealIngredient.quantity, MealIngredient.unit
+    ).filter(MealIngredient.meal_id == meal_id).order_by(MealIngredient.id).all()
+
+    kept: set[int] = set()
+    deleted_ids: list[int] = []
+    updated_rows: list[Dict[str, Any]] = []
+    for line in current:
+        if line.ingredient_id not in wanted or line.ingredient_id in kept:
+            deleted_ids.append(line.id)
+            continue
+        kept.add(line.ingredient_id)
+        quantity, unit = wanted[line.ingredient_id]
+        if (line.quantity, line.unit) != (quantity, unit):
+            updated_rows.append({"id": line.id, "quantity": quantity, "unit": unit})
+    new_rows = [
+        {"meal_id": meal_id, "ingredient_id": ingredient_id, "quantity": quantity, "unit": unit}
+        for ingredient_id, (quantity, unit) in wanted.items() if ingredient_id not in kept
+    ]
 
-def create_meal_db(db_session: Session, meal: MealCreate) -> Meal:
-    """Create a new meal in the database."""
+    if deleted_ids:
+        # noinspection PyTypeChecker
+        db_session.execute(
+            delete(MealIngredient).where(MealIngredient.id.in_(deleted_ids))
+            .execution_options(synchronize_session=False)
+        )
+    if updated_rows:
+        db_session.execute(update(MealIngredient), updated_rows)
+    if new_rows:
+        db_session.execute(insert(MealIngredient), new_rows)
+    return bool(deleted_ids or updated_rows or new_rows)
+
+
+def create_meal_db(db_session: Session, meal: MealCreate) -> MealResponse:
+    """Create a new meal and its recipe lines in one transaction."""
     db_meal = Meal(
         name=meal.name,
         description=meal.description,
@@ -135,47 +402,44 @@ def create_meal_db(db_session: Session, meal: MealCreate) -> Meal:
         preparation_time=meal.preparation_time
     )
     db_session.add(db_meal)
-    db_session.commit()
-    db_session.refresh(db_meal)
-
-    for ingredient_data in meal.ingredients:
-        db_meal_ingredient = MealIngredient(
-            meal_id=db_meal.id,
-            ingredient_id=ingredient_data.ingredient_id,
-            quantity=ingredient_data.quantity,
-            unit=ingredient_data.unit
-        )
-        db_session.add(db_meal_ingredient)
+    db_session.flush()
+
+    recipe = _merge_recipe_lines(meal.ingredients)
+    if recipe:
+        db_session.execute(insert(MealIngredient), [
+            {"meal_id": db_meal.id, "ingredient_id": ingredient_id, "quantity": quantity, "unit": unit}
+            for ingredient_id, (quantity, unit) in recipe.items()
+        ])
 
     db_session.commit()
-    return db_meal
+    max_portions_cache.invalidate_meal(db_meal.id)
+    return get_meal(db_session, db_meal.id)
 
 
-def update_meal_db(db_session: Session, meal_id: int, meal_update: MealUpdate) -> Meal | None:
-    """Update an existing meal."""
+def update_meal_db(db_session: Session, meal_id: int, meal_update: MealUpdate) -> MealResponse | None:
+    """Update an existing meal; only the recipe lines that differ are written."""
     # noinspection PyTypeChecker
     db_meal = db_session.query(Meal).filter(Meal.id == meal_id).first()
     if db_meal:
         update_data = meal_update.model_dump(exclude_unset=True, exclude={'ingredients'})
-        for field, value in update_data.items():
-            setattr(db_meal, field, value)
-
-        if meal_update.ingredients is not None:
-            # noinspection PyTypeChecker
-            db_session.query(MealIngredient).filter(MealIngredient.meal_id == meal_id).delete()
-            for ingredient_data in meal_update.ingredients:
-                db_meal_ingredient = MealIngredient(
-                    meal_id=meal_id,
-                    ingredient_id=ingredient_data.ingredient_id,
-                    quantity=ingredient_data.quantity,
-                    unit=ingredient_data.unit
-                )
-                db_session.add(db_meal_ingredient)
-
-        db_meal.updated_at = datetime.now(timezone.utc)
-        db_session.commit()
-        db_session.refresh(db_meal)
-    return db_meal
+        changed_fields = {field for field, value in update_data.items() if getattr(db_meal, field) != value}
+        for field in changed_fields:
+            setattr(db_meal, field, update_data[field])
+
+        recipe_changed = meal_update.ingredients is not None \
+            and _write_recipe(db_session, meal_id, meal_update.ingredients)
+
+        if changed_fields or recipe_changed:
+            db_meal.updated_at = datetime.now(timezone.utc)
+            db_session.commit()
+            # Max portions carry the meal name; analytics only show names, past usage is
+            # recorded per serving and does not follow recipe edits
+            if recipe_changed or "name" in changed_fields:
+                max_portions_cache.invalidate_meal(meal_id)
+            if "name" in changed_fields:
+                analytics_cache.invalidate(ANALYTICS_NAMESPACE)
+        return get_meal(db_session, meal_id)
+    return None
 
 
 def delete_meal_db(db_session: Session, meal_id: int) -> Dict[str, str]:
@@ -185,147 +449,611 @@ def delete_meal_db(db_session: Session, meal_id: int) -> Dict[str, str]:
     if db_meal:
         # noinspection PyTypeChecker
         db_session.query(MealIngredient).filter(MealIngredient.meal_id == meal_id).delete()
+        # noinspection PyTypeChecker
+        db_session.query(DailyMealPortions).filter(DailyMealPortions.meal_id == meal_id).delete()
         db_session.delete(db_meal)
         db_session.commit()
+        max_portions_cache.invalidate_meal(meal_id)
+        analytics_cache.invalidate(ANALYTICS_NAMESPACE)
     return {"message": "Meal deleted successfully"}
 
 
+class MaxPortionsCache:
+    """Max-portions results per meal, recomputed only for the meals a change affects.
+
+    Ingredient and recipe writes mark ingredients or meals stale; the next read recomputes just
+    those meals with one query. Entries also expire after MAX_PORTIONS_CACHE_TTL seconds so
+    writes made by other workers show up.
+    """
+
+    def __init__(self, ttl: float = MAX_PORTIONS_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.results: Dict[int, Dict[str, Any]] = {}
+        self.complete = False
+        self.loaded_at = 0.0
+        self.stale_meals: set[int] = set()
+        self.stale_ingredients: set[int] = set()
+
+    def invalidate_ingredients(self, ingredient_ids: Iterable[int]):
+        with self.lock:
+            self.stale_ingredients.update(ingredient_ids)
+
+    def invalidate_meal(self, meal_id: int):
+        with self.lock:
+            self.stale_meals.add(meal_id)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.complete = False
+
+    def _refresh(self, db_session: Session):
+        with self.lock:
+            expired = time.monotonic() - self.loaded_at > self.ttl
+            full_reload = not self.complete or expired
+            stale_meals, self.stale_meals = self.stale_meals, set()
+            stale_ingredients, self.stale_ingredients = self.stale_ingredients, set()
+
+        if full_reload:
+            results = {row["meal_id"]: row for row in _compute_max_portions(db_session)}
+            with self.lock:
+                self.results = results
+                self.complete = True
+                self.loaded_at = time.monotonic()
+        elif stale_meals or stale_ingredients:
+            results = {
+                row["meal_id"]: row
+                for row in _compute_max_portions(db_session, stale_meals, stale_ingredients)
+            }
+            with self.lock:
+                for meal_id in stale_meals - results.keys():
+                    # Deleted meals simply disappear
+                    self.results.pop(meal_id, None)
+                self.results.update(results)
+
+    def get_all(self, db_session: Session) -> list[Dict[str, Any]]:
+        self._refresh(db_session)
+        with self.lock:
+            return sorted(self.results.values(), key=lambda row: row["meal_id"])
+
+    def get(self, db_session: Session, meal_id: int) -> Dict[str, Any] | None:
+        self._refresh(db_session)
+        with self.lock:
+            return self.results.get(meal_id)
+
+
+max_portions_cache = MaxPortionsCache()
+
+
+def _compute_max_portions(db_session: Session, meal_ids: set[int] | None = None,
+                          ingredient_ids: set[int] | None = None) -> list[Dict[str, Any]]:
+    """Compute max portions and the limiting ingredient for meals in one aggregate query.
+
+    Without arguments every meal is computed; otherwise only the given meals plus the meals
+    that use any of the given ingredients.
+    """
+    portions = Ingredient.quantity / MealIngredient.quantity
+    # noinspection PyTypeChecker
+    ranked = db_session.query(
+        MealIngredient.meal_id,
+        Ingredient.name,
+        portions.label("portions"),
+        func.row_number().over(
+            partition_by=MealIngredient.meal_id,
+            order_by=(portions, Ingredient.id)
+        ).label("rank")
+    ).join(Ingredient, Ingredient.id == MealIngredient.ingredient_id) \
+        .filter(MealIngredient.quantity > 0).subquery()
+
+    # noinspection PyTypeChecker
+    query = db_session.query(Meal.id, Meal.name, ranked.c.name.label("limiting_ingredient"), ranked.c.portions) \
+        .outerjoin(ranked, (ranked.c.meal_id == Meal.id) & (ranked.c.rank == 1))
+    if meal_ids is not None or ingredient_ids is not None:
+        # noinspection PyTypeChecker
+        using_ingredients = db_session.query(MealIngredient.meal_id) \
+            .filter(MealIngredient.ingredient_id.in_(ingredient_ids or set()))
+        query = query.filter(Meal.id.in_(meal_ids or set()) | Meal.id.in_(using_ingredients))
+
+    return [
+        {
+            "meal_id": row.id,
+            "meal_name": row.name,
+            "max_portions": max(math.floor(row.portions), 0) if row.portions is not None else 0,
+            "limiting_ingredient": row.limiting_ingredient
+        }
+        for row in query.all()
+    ]
+
+
 def calculate_max_portions(db_session: Session, meal_id: int) -> Dict[str, Union[int, None | str]]:
     """Calculate the maximum number of portions available for a meal."""
-    # noinspection PyTypeChecker
-    meal = db_session.query(Meal).filter(Meal.id == meal_id).first()
-    if not meal:
+    result = max_portions_cache.get(db_session, meal_id)
+    if result is None:
         return {"max_portions": 0, "limiting_ingredient": None}
+    return {"max_portions": result["max_portions"], "limiting_ingredient": result["limiting_ingredient"]}
 
-    min_portions = float('inf')
-    limiting_ingredient = None
 
-    for meal_ingredient in meal.ingredients:
-        ingredient = meal_ingredient.ingredient
-        possible_portions = ingredient.quantity // meal_ingredient.quantity
+def calculate_all_max_portions(db_session: Session) -> list[Dict[str, Any]]:
+    """Calculate the maximum number of portions available for every meal."""
+    return max_portions_cache.get_all(db_session)
 
-        if possible_portions < min_portions:
-            min_portions = possible_portions
-            limiting_ingredient = ingredient.name
 
-    return {
-        "max_portions": int(min_portions) if min_portions != float('inf') else 0,
-        "limiting_ingredient": limiting_ingredient
-    }
+# Serving operations
+# How often a serving re-reads the stock after losing a reservation race before giving up
+SERVE_RESERVATION_ATTEMPTS = 3
 
 
-# Serving operations
-def serve_meal_db(db_session: Session, serving: ServingCreate, user_id: int) -> ServingLog:
-    """Record a meal serving and update inventory."""
-    # noinspection PyTypeChecker
-    meal = db_session.query(Meal).filter(Meal.id == serving.meal_id).first()
-    # noinspection PyTypeChecker
-    user = db_session.query(User).filter(User.id == user_id).first()
-
-    if not meal or not user:
-        raise HTTPException(status_code=404, detail="Meal or user not found")
-
-    insufficient_ingredients = []
-    for meal_ingredient in meal.ingredients:
-        ingredient = meal_ingredient.ingredient
-        needed_quantity = meal_ingredient.quantity * serving.portions
-
-        if ingredient.quantity < needed_quantity:
-            insufficient_ingredients.append({
-                "name": ingredient.name,
-                "needed": needed_quantity,
-                "available": ingredient.quantity,
-                "unit": meal_ingredient.unit
-            })
-
-    if insufficient_ingredients:
-        first_issue = insufficient_ingredients[0]
-        failure_reason = (f"Insufficient {first_issue['name']} "
-                          f"(needed {first_issue['needed']}{first_issue['unit']}, "
-                          f"had {first_issue['available']}{first_issue['unit']})")
-        status = "failed"
-    else:
-        for meal_ingredient in meal.ingredients:
-            ingredient = meal_ingredient.ingredient
-            needed_quantity = meal_ingredient.quantity * serving.portions
-            ingredient.quantity -= needed_quantity
-            ingredient.updated_at = datetime.now(timezone.utc)
+def reserve_stock(db_session: Session, needed: Dict[int, float]) -> list[tuple[int, float, float]] | None:
+    """Atomically deduct the needed quantity of every ingredient, or nothing at all.
+
+    A single conditional UPDATE only touches rows that still hold enough stock, so two concurrent
+    servings can never drive an ingredient negative. If any row was skipped the whole transaction
+    is rolled back and None is returned. Otherwise the (id, quantity, threshold) after deduction
+    is returned and the caller commits.
+    """
+    if not needed:
+        return []
+    deducted = case(needed, value=Ingredient.id)
+    # noinspection PyTypeChecker
+    rows = db_session.execute(
+        update(Ingredient)
+        .where(Ingredient.id.in_(needed), Ingredient.quantity >= deducted)
+        .values(quantity=Ingredient.quantity - deducted, updated_at=datetime.now(timezone.utc))
+        .returning(Ingredient.id, Ingredient.quantity, Ingredient.threshold)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if len(rows) != len(needed):
+        db_session.rollback()
+        return None
+    return [(row.id, float(row.quantity), row.threshold) for row in rows]
+
+
+def _load_serving_recipes(db_session: Session, meal_ids: set[int], user_id: int) -> list[Any]:
+    """Read meal names, the user name, recipe lines and current stock for several meals in one query."""
+    # noinspection PyTypeChecker
+    return db_session.query(
+        Meal.id.label("meal_id"),
+        Meal.name.label("meal_name"),
+        User.name.label("user_name"),
+        MealIngredient.ingredient_id,
+        MealIngredient.quantity.label("per_portion"),
+        MealIngredient.unit,
+        Ingredient.name.label("ingredient_name"),
+        Ingredient.quantity.label("available")
+    ).select_from(Meal) \
+        .join(User, User.id == user_id) \
+        .outerjoin(MealIngredient, MealIngredient.meal_id == Meal.id) \
+        .outerjoin(Ingredient, Ingredient.id == MealIngredient.ingredient_id) \
+        .filter(Meal.id.in_(meal_ids)) \
+        .order_by(Meal.id, MealIngredient.ingredient_id).all()
+
+
+def _plan_servings(recipe: list[Any], servings: list[ServingCreate]) \
+        -> tuple[list[str | None], list[Dict[int, float]], Dict[int, float]]:
+    """Decide which servings succeed, in request order, against the stock read in one query.
+
+    Returns a failure reason (or None) per serving, the ingredients each serving consumes
+    (empty if it failed) and the total demand of the successful ones.
+    """
+    lines_by_meal: Dict[int, list[Any]] = {}
+    remaining: Dict[int, float] = {}
+    for line in recipe:
+        meal_lines = lines_by_meal.setdefault(line.meal_id, [])
+        if line.ingredient_name is not None:
+            meal_lines.append(line)
+            remaining[line.ingredient_id] = line.available
+
+    failure_reasons: list[str | None] = []
+    consumption: list[Dict[int, float]] = []
+    total_demand: Dict[int, float] = {}
+    for serving in servings:
+        needed: Dict[int, float] = {}
+        labels: Dict[int, tuple[str, str]] = {}
+        for line in lines_by_meal[serving.meal_id]:
+            needed[line.ingredient_id] = needed.get(line.ingredient_id, 0) + line.per_portion * serving.portions
+            labels[line.ingredient_id] = (line.ingredient_name, line.unit)
+
         failure_reason = None
-        status = "success"
-
-    serving_log = ServingLog(
-        meal_id=serving.meal_id,
-        user_id=user_id,
-        portions=serving.portions,
-        status=status,
-        failure_reason=failure_reason
-    )
+        for ingredient_id, quantity in needed.items():
+            if remaining[ingredient_id] < quantity:
+                name, unit = labels[ingredient_id]
+                failure_reason = (f"Insufficient {name} "
+                                  f"(needed {quantity}{unit}, "
+                                  f"had {remaining[ingredient_id]}{unit})")
+                break
+        if failure_reason is None:
+            for ingredient_id, quantity in needed.items():
+                remaining[ingredient_id] -= quantity
+                total_demand[ingredient_id] = total_demand.get(ingredient_id, 0) + quantity
+        failure_reasons.append(failure_reason)
+        consumption.append({} if failure_reason else needed)
+    return failure_reasons, consumption, total_demand
+
+
+def serve_meals_batch_db(db_session: Session, servings: list[ServingCreate],
+                         user_id: int) -> tuple[list[ServingLogResponse], list[tuple[int, float, float]]]:
+    """Record several servings in one transaction and update inventory.
+
+    Servings are checked in order against the stock left by the ones before them. Those that fit
+    succeed and the rest get a failed log row, as if they had been posted one by one. The stock for
+    all successful servings is reserved with one guarded UPDATE and the log rows are bulk inserted.
+    Returns the serving logs and the (id, quantity, threshold) of every ingredient that was deducted.
+    """
+    if not servings:
+        return [], []
+    meal_ids = {serving.meal_id for serving in servings}
+
+    stock_levels: list[tuple[int, float, float]] = []
+    for _ in range(SERVE_RESERVATION_ATTEMPTS):
+        recipe = _load_serving_recipes(db_session, meal_ids, user_id)
+        meal_names = {line.meal_id: line.meal_name for line in recipe}
+        if not recipe or meal_names.keys() != meal_ids:
+            raise HTTPException(status_code=404, detail="Meal or user not found")
+
+        failure_reasons, consumption, total_demand = _plan_servings(recipe, servings)
+        reserved = reserve_stock(db_session, total_demand)
+        if reserved is not None:
+            stock_levels = reserved
+            break
+        # Another serving took the stock between our read and our UPDATE, plan again
+    else:
+        failure_reasons = ["Stock changed by concurrent servings, please retry"] * len(servings)
+        consumption = [{} for _ in servings]
+
+    served_at = datetime.now(timezone.utc)
+    meal_portions: Dict[int, int] = {}
+    for serving, failure_reason in zip(servings, failure_reasons):
+        if failure_reason is None:
+            meal_portions[serving.meal_id] = meal_portions.get(serving.meal_id, 0) + serving.portions
+    if meal_portions:
+        record_daily_usage(db_session, served_at.date(), total_demand, meal_portions)
+
+    log_rows = [
+        {
+            "meal_id": serving.meal_id,
+            "user_id": user_id,
+            "portions": serving.portions,
+            "status": "failed" if failure_reason else "success",
+            "failure_reason": failure_reason,
+            "timestamp": served_at
+        }
+        for serving, failure_reason in zip(servings, failure_reasons)
+    ]
+    # noinspection PyTypeChecker
+    log_ids = db_session.scalars(
+        insert(ServingLog).returning(ServingLog.id, sort_by_parameter_order=True),
+        log_rows
+    ).all()
 
-    db_session.add(serving_log)
+    snapshot_rows = [
+        {"serving_log_id": log_id, "ingredient_id": ingredient_id, "quantity": quantity, "timestamp": served_at}
+        for log_id, consumed in zip(log_ids, consumption)
+        for ingredient_id, quantity in consumed.items()
+    ]
+    if snapshot_rows:
+        db_session.execute(insert(ServingLogIngredient), snapshot_rows)
+
+    user_name = recipe[0].user_name
+    responses = [
+        ServingLogResponse(id=log_id, meal_name=meal_names[row["meal_id"]], user_name=user_name, **row)
+        for log_id, row in zip(log_ids, log_rows)
+    ]
     db_session.commit()
-    db_session.refresh(serving_log)
-    return serving_log
+    max_portions_cache.invalidate_ingredients(ingredient_id for ingredient_id, _, _ in stock_levels)
+    dashboard_counters.record_servings(served_at, sum(meal_portions.values()), stock_levels)
+    analytics_cache.invalidate(ANALYTICS_NAMESPACE)
+    return responses, stock_levels
+
+
+def serve_meal_db(db_session: Session, serving: ServingCreate,
+                  user_id: int) -> tuple[ServingLogResponse, list[tuple[int, float, float]]]:
+    """Record a meal serving and update inventory.
+
+    Returns the serving log and the (id, quantity, threshold) of every ingredient that was deducted.
+    """
+    serving_logs, stock_levels = serve_meals_batch_db(db_session, [serving], user_id)
+    return serving_logs[0], stock_levels
+
+
+def get_serving_logs(db_session: Session, skip: int = 0, limit: int = 100,
+                     after: str | None = None) -> tuple[list[ServingLogResponse], str | None]:
+    """Get a page of serving logs, newest first, and the cursor for the next page.
+
+    Pages are walked by (timestamp, id) on ix_serving_logs_timestamp_id, so a deep page
+    costs the same as the first one.
+    """
+    # noinspection PyTypeChecker
+    query = db_session.query(
+        ServingLog.id,
+        ServingLog.meal_id,
+        func.coalesce(Meal.name, "").label("meal_name"),
+        ServingLog.user_id,
+        func.coalesce(User.name, "").label("user_name"),
+        ServingLog.portions,
+        ServingLog.status,
+        ServingLog.failure_reason,
+        ServingLog.timestamp
+    ).outerjoin(Meal, Meal.id == ServingLog.meal_id) \
+        .outerjoin(User, User.id == ServingLog.user_id)
+    if after:
+        after_timestamp, after_id = decode_cursor(after, 2)
+        try:
+            after_key = (datetime.fromisoformat(after_timestamp), int(after_id))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # noinspection PyTypeChecker
+        query = query.filter(tuple_(ServingLog.timestamp, ServingLog.id) < after_key)
+
+    rows = query.order_by(desc(ServingLog.timestamp), desc(ServingLog.id)).offset(skip).limit(limit).all()
+    next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id) if rows and len(rows) == limit else None
+    return [ServingLogResponse(**row._mapping) for row in rows], next_cursor
+
+
+# Daily analytics rollups
+def _increment_rollup(db_session: Session, model: type, key_columns: list[str], value_column: str,
+                      rows: list[Dict[str, Any]]):
+    """Add rows to a rollup table, summing into any row that already has the same key."""
+    if not rows:
+        return
+    dialect = db_session.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        statement = upsert(model).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={value_column: getattr(model, value_column) + getattr(statement.excluded, value_column)}
+        )
+        db_session.execute(statement)
+        return
+
+    for row in rows:
+        key = [getattr(model, column) == row[column] for column in key_columns]
+        # noinspection PyTypeChecker
+        updated = db_session.execute(
+            update(model).where(*key)
+            .values({value_column: getattr(model, value_column) + row[value_column]})
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            db_session.execute(insert(model).values(row))
+
+
+def record_daily_usage(db_session: Session, day: date, ingredient_usage: Dict[int, float],
+                       meal_portions: Dict[int, int]):
+    """Add successful servings to the daily rollups; runs inside the serving transaction."""
+    _increment_rollup(
+        db_session, DailyIngredientUsage, ["day", "ingredient_id"], "quantity",
+        [{"day": day, "ingredient_id": ingredient_id, "quantity": quantity}
+         for ingredient_id, quantity in ingredient_usage.items()]
+    )
+    _increment_rollup(
+        db_session, DailyMealPortions, ["day", "meal_id"], "portions",
+        [{"day": day, "meal_id": meal_id, "portions": portions}
+         for meal_id, portions in meal_portions.items()]
+    )
 
 
-def get_serving_logs(db_session: Session, skip: int = 0, limit: int = 100) -> list[type[ServingLog]]:
-    """Get a paginated list of serving logs."""
-    return db_session.query(ServingLog).order_by(desc(ServingLog.timestamp)).offset(skip).limit(limit).all()
+def rebuild_daily_rollups(db_session: Session) -> Dict[str, int]:
+    """Recompute both daily rollups from serving_logs, replacing their contents."""
+    serving_day = func.date(ServingLog.timestamp)
+    db_session.execute(delete(DailyMealPortions))
+    db_session.execute(delete(DailyIngredientUsage))
+
+    # noinspection PyTypeChecker
+    meal_portions = db_session.query(
+        serving_day, ServingLog.meal_id, func.sum(ServingLog.portions)
+    ).filter(
+        # Deleting a meal leaves its serving logs with no meal_id
+        ServingLog.status == "success", ServingLog.meal_id.isnot(None)
+    ).group_by(serving_day, ServingLog.meal_id)
+    meal_rows = db_session.execute(
+        insert(DailyMealPortions).from_select(["day", "meal_id", "portions"], meal_portions)
+    ).rowcount
+
+    # Servings recorded before consumption was snapshotted only know the current recipe
+    snapshotted = db_session.query(ServingLogIngredient.id) \
+        .filter(ServingLogIngredient.serving_log_id == ServingLog.id).exists()
+    # noinspection PyTypeChecker
+    consumed = union_all(
+        select(
+            func.date(ServingLogIngredient.timestamp).label("day"),
+            ServingLogIngredient.ingredient_id,
+            ServingLogIngredient.quantity
+        ),
+        select(
+            serving_day.label("day"),
+            MealIngredient.ingredient_id,
+            (MealIngredient.quantity * ServingLog.portions).label("quantity")
+        ).join(MealIngredient, MealIngredient.meal_id == ServingLog.meal_id)
+        .where(ServingLog.status == "success", MealIngredient.ingredient_id.isnot(None), ~snapshotted)
+    ).subquery()
+    ingredient_usage = select(consumed.c.day, consumed.c.ingredient_id, func.sum(consumed.c.quantity)) \
+        .group_by(consumed.c.day, consumed.c.ingredient_id)
+    ingredient_rows = db_session.execute(
+        insert(DailyIngredientUsage).from_select(["day", "ingredient_id", "quantity"], ingredient_usage)
+    ).rowcount
+
+    db_session.commit()
+    return {"daily_meal_portions": meal_rows, "daily_ingredient_usage": ingredient_rows}
 
 
 # Analytics functions
+def utc_today() -> date:
+    """The current day as serving timestamps and the daily rollups count it."""
+    return datetime.now(timezone.utc).date()
+
+
+def _day_range(day: date) -> tuple[datetime, datetime]:
+    """Half-open [start, end) bounds of a calendar day, so timestamp filters can use an index."""
+    start = datetime.combine(day, dt_time.min)
+    return start, start + timedelta(days=1)
+
+
 def get_dashboard_stats(db_session: Session) -> Dict[str, Any]:
     """Get statistics for the dashboard."""
-    total_ingredients = db_session.query(Ingredient).count()
-    # noinspection PyTypeChecker
-    low_stock_items = db_session.query(Ingredient).filter(Ingredient.quantity <= Ingredient.threshold).count()
+    if dashboard_counters.enabled:
+        return dashboard_counters.get(db_session)
 
-    today = datetime.now(timezone.utc).date()
+    today_start, today_end = _day_range(utc_today())
     # noinspection PyTypeChecker
-    meals_served_today = db_session.query(func.sum(ServingLog.portions)).filter(
-        func.date(ServingLog.timestamp) == today,
-        ServingLog.status == "success"
-    ).scalar() or 0
+    meals_served_today = select(func.coalesce(func.sum(ServingLog.portions), 0)).where(
+        ServingLog.status == "success",
+        ServingLog.timestamp >= today_start,
+        ServingLog.timestamp < today_end
+    ).scalar_subquery()
 
-    inventory_value = db_session.query(func.sum(Ingredient.quantity * Ingredient.cost)).scalar() or 0
+    # noinspection PyTypeChecker
+    row = db_session.query(
+        func.count(Ingredient.id).label("total_ingredients"),
+        func.count(case((Ingredient.quantity <= Ingredient.threshold, 1))).label("low_stock_items"),
+        func.coalesce(func.sum(Ingredient.quantity * Ingredient.cost), 0).label("inventory_value"),
+        meals_served_today.label("meals_served_today")
+    ).one()
 
     return {
-        "total_ingredients": total_ingredients,
-        "low_stock_items": low_stock_items,
-        "meals_served_today": meals_served_today,
-        "inventory_value": round(inventory_value, 2)
+        "total_ingredients": row.total_ingredients,
+        "low_stock_items": row.low_stock_items,
+        "meals_served_today": row.meals_served_today,
+        "inventory_value": round(row.inventory_value, 2)
     }
 
 
+class DashboardCounters:
+    """Dashboard statistics kept in process and updated by the write paths.
+
+    Every ingredient's contribution is remembered so a write adjusts the totals in constant
+    time. The counters are rebuilt from the database on the first read, at the start of a new
+    day and every DASHBOARD_RECONCILE_SECONDS, which also picks up writes made by other workers.
+    """
+
+    def __init__(self, enabled: bool = DASHBOARD_LIVE_COUNTERS,
+                 reconcile_seconds: float = DASHBOARD_RECONCILE_SECONDS):
+        self.enabled = enabled
+        self.reconcile_seconds = reconcile_seconds
+        self.lock = threading.Lock()
+        # ingredient id -> (quantity, threshold, cost)
+        self.ingredients: Dict[int, tuple[float, float, float]] = {}
+        self.low_stock_items = 0
+        self.inventory_value = 0.0
+        self.meals_served_today = 0
+        self.day: date | None = None
+        self.reconciled_at = 0.0
+        self.version = 0
+
+    def _add(self, ingredient_id: int, values: tuple[float, float, float]):
+        quantity, threshold, cost = values
+        self.ingredients[ingredient_id] = values
+        self.low_stock_items += quantity <= threshold
+        self.inventory_value += quantity * cost
+
+    def _remove(self, ingredient_id: int):
+        values = self.ingredients.pop(ingredient_id, None)
+        if values is not None:
+            quantity, threshold, cost = values
+            self.low_stock_items -= quantity <= threshold
+            self.inventory_value -= quantity * cost
+
+    def set_ingredient(self, ingredient: Ingredient):
+        if not self.enabled:
+            return
+        with self.lock:
+            self._remove(ingredient.id)
+            self._add(ingredient.id, (ingredient.quantity, ingredient.threshold, ingredient.cost))
+            self.version += 1
+
+    def remove_ingredient(self, ingredient_id: int):
+        if not self.enabled:
+            return
+        with self.lock:
+            self._remove(ingredient_id)
+            self.version += 1
+
+    def record_servings(self, served_at: datetime, portions: int, stock_levels: list[tuple[int, float, float]]):
+        """Apply a committed serving batch: portions served and the new stock of deducted ingredients."""
+        if not self.enabled:
+            return
+        with self.lock:
+            for ingredient_id, quantity, threshold in stock_levels:
+                cost = self.ingredients.get(ingredient_id, (0, 0, 0))[2]
+                self._remove(ingredient_id)
+                self._add(ingredient_id, (quantity, threshold, cost))
+            if served_at.date() == self.day:
+                self.meals_served_today += portions
+            self.version += 1
+
+    def _reconcile(self, db_session: Session, today: date):
+        with self.lock:
+            version = self.version
+        # noinspection PyTypeChecker
+        ingredients = db_session.query(Ingredient.id, Ingredient.quantity, Ingredient.threshold, Ingredient.cost).all()
+        today_start, today_end = _day_range(today)
+        # noinspection PyTypeChecker
+        meals_served_today = db_session.query(func.sum(ServingLog.portions)).filter(
+            ServingLog.status == "success",
+            ServingLog.timestamp >= today_start,
+            ServingLog.timestamp < today_end
+        ).scalar() or 0
+
+        with self.lock:
+            self.ingredients = {}
+            self.low_stock_items = 0
+            self.inventory_value = 0.0
+            for ingredient_id, quantity, threshold, cost in ingredients:
+                self._add(ingredient_id, (quantity, threshold, cost))
+            self.meals_served_today = meals_served_today
+            self.day = today
+            # A write that landed while we were reading may be missing, so reconcile again soon
+            self.reconciled_at = time.monotonic() if self.version == version else 0.0
+
+    def get(self, db_session: Session) -> Dict[str, Any]:
+        today = utc_today()
+        with self.lock:
+            due = self.day != today or time.monotonic() - self.reconciled_at > self.reconcile_seconds
+        if due:
+            self._reconcile(db_session, today)
+
+        with self.lock:
+            return {
+                "total_ingredients": len(self.ingredients),
+                "low_stock_items": self.low_stock_items,
+                "meals_served_today": self.meals_served_today,
+                "inventory_value": round(self.inventory_value, 2)
+            }
+
+
+dashboard_counters = DashboardCounters()
+
+
 def get_ingredient_usage_data(db_session: Session, days: int = 30) -> list[dict[str, Any]]:
-    """Get ingredient usage data for visualization."""
-    usage_start_date = datetime.now(timezone.utc) - timedelta(days=days)
+    """Get ingredient usage data for visualization, from the daily rollup."""
+    usage_start_day = (datetime.now(timezone.utc) - timedelta(days=days)).date()
 
     # noinspection PyTypeChecker
     usage_data = db_session.query(
         Ingredient.name,
-        func.sum(MealIngredient.quantity * ServingLog.portions).label('total_used')
-    ).join(MealIngredient, MealIngredient.ingredient_id == Ingredient.id) \
-        .join(ServingLog, ServingLog.meal_id == MealIngredient.meal_id) \
-        .filter(
-        ServingLog.timestamp >= usage_start_date,
-        ServingLog.status == "success"
-    ).group_by(Ingredient.name).all()
+        func.sum(DailyIngredientUsage.quantity).label('total_used')
+    ).join(DailyIngredientUsage, DailyIngredientUsage.ingredient_id == Ingredient.id) \
+        .filter(DailyIngredientUsage.day >= usage_start_day) \
+        .group_by(Ingredient.name).all()
 
     return [{"name": item.name, "total_used": item.total_used} for item in usage_data]
 
 
 def get_meal_popularity_data(db_session: Session, days: int = 30) -> list[dict[str, Any]]:
-    """Get meal popularity data for visualization."""
-    popularity_start_date = datetime.now(timezone.utc) - timedelta(days=days)
+    """Get meal popularity data for visualization, from the daily rollup."""
+    popularity_start_day = (datetime.now(timezone.utc) - timedelta(days=days)).date()
 
     # noinspection PyTypeChecker
     popularity = db_session.query(
         Meal.name,
-        func.sum(ServingLog.portions).label('total_portions')
-    ).join(ServingLog).filter(
-        ServingLog.timestamp >= popularity_start_date,
-        ServingLog.status == "success"
-    ).group_by(Meal.name).all()
+        func.sum(DailyMealPortions.portions).label('total_portions')
+    ).join(DailyMealPortions, DailyMealPortions.meal_id == Meal.id) \
+        .filter(DailyMealPortions.day >= popularity_start_day) \
+        .group_by(Meal.name).all()
 
     total_portions = sum([p.total_portions for p in popularity]) or 1
 
@@ -388,44 +1116,164 @@ def update_system_settings(db_session: Session, settings: SettingsUpdate) -> Dic
 
 
 # Report generation
+def get_inventory_report_totals(db_session: Session) -> Dict[str, Any]:
+    """Count, value and low-stock count of all ingredients in one aggregate query."""
+    # noinspection PyTypeChecker
+    row = db_session.query(
+        func.count(Ingredient.id).label("total_items"),
+        func.coalesce(func.sum(Ingredient.quantity * Ingredient.cost), 0).label("total_value"),
+        func.count(case((Ingredient.quantity <= Ingredient.threshold, 1))).label("low_stock_items")
+    ).one()
+    return {"total_items": row.total_items, "total_value": row.total_value, "low_stock_items": row.low_stock_items}
+
+
+INVENTORY_REPORT_COLUMNS = ["name", "quantity", "unit", "value", "status", "category"]
+
+
+def iter_inventory_report_rows(db_session: Session) -> Iterator[Dict[str, Any]]:
+    """Stream the inventory report lines from a server-side cursor, REPORT_BATCH_SIZE rows at a time."""
+    # noinspection PyTypeChecker
+    query = db_session.query(
+        Ingredient.name,
+        Ingredient.quantity,
+        Ingredient.unit,
+        (Ingredient.quantity * Ingredient.cost).label("value"),
+        case((Ingredient.quantity <= Ingredient.threshold, "low"), else_="good").label("status"),
+        Ingredient.category
+    ).order_by(Ingredient.id).yield_per(REPORT_BATCH_SIZE)
+    for row in query:
+        yield row._asdict()
+
+
 def generate_inventory_report_data(db_session: Session) -> Dict[str, Any]:
     """Generate inventory report data."""
-    ingredients = db_session.query(Ingredient).all()
-
     return {
         "generated_at": datetime.now(timezone.utc).isoformat(),
-        "total_items": len(ingredients),
-        "total_value": sum([ing.quantity * ing.cost for ing in ingredients]),
-        "low_stock_items": len([ing for ing in ingredients if ing.quantity <= ing.threshold]),
-        "ingredients": [
-            {
-                "name": ing.name,
-                "quantity": ing.quantity,
-                "unit": ing.unit,
-                "value": ing.quantity * ing.cost,
-                "status": "low" if ing.quantity <= ing.threshold else "good",
-                "category": ing.category
-            }
-            for ing in ingredients
-        ]
+        **get_inventory_report_totals(db_session),
+        "ingredients": list(iter_inventory_report_rows(db_session))
     }
 
 
-def generate_usage_report_data(db_session: Session, report_start_date: str, report_end_date: str) -> Dict[str, Any]:
-    """Generate usage report data."""
-    start = datetime.fromisoformat(report_start_date)
-    end = datetime.fromisoformat(report_end_date)
+def _report_range(report_start_date: str, report_end_date: str) -> tuple[datetime, datetime]:
+    """Turn the report dates into a half-open [start, end) range.
+
+    A date-only end such as "2024-03-31" includes that whole day.
+    """
+    try:
+        start = datetime.fromisoformat(report_start_date)
+        end = datetime.fromisoformat(report_end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in ISO format")
+    if len(report_end_date) == 10:
+        end += timedelta(days=1)
+    return start, end
+
 
+def get_usage_report_totals(db_session: Session, report_start_date: str, report_end_date: str) -> Dict[str, Any]:
+    """Portions served, servings attempted and the share that succeeded in the range, in one aggregate query."""
+    start, end = _report_range(report_start_date, report_end_date)
+    succeeded = ServingLog.status == "success"
     # noinspection PyTypeChecker
-    serving_logs = db_session.query(ServingLog).filter(
-        ServingLog.timestamp >= start,
-        ServingLog.timestamp <= end,
-        ServingLog.status == "success"
-    ).all()
+    row = db_session.query(
+        func.coalesce(func.sum(case((succeeded, ServingLog.portions), else_=0)), 0).label("total_meals_served"),
+        func.count(case((succeeded, 1))).label("successful"),
+        func.count(ServingLog.id).label("attempted")
+    ).filter(ServingLog.timestamp >= start, ServingLog.timestamp < end).one()
+    return {
+        "total_meals_served": row.total_meals_served,
+        "total_servings": row.attempted,
+        "success_rate": row.successful / row.attempted if row.attempted else 0
+    }
+
+
+def get_usage_report_ingredients(db_session: Session, report_start_date: str,
+                                 report_end_date: str) -> list[Dict[str, Any]]:
+    """Total consumption per ingredient in the range, from one range scan of the snapshot table."""
+    start, end = _report_range(report_start_date, report_end_date)
+    # noinspection PyTypeChecker
+    consumed = db_session.query(
+        ServingLogIngredient.ingredient_id,
+        func.sum(ServingLogIngredient.quantity).label("total_used")
+    ).filter(
+        ServingLogIngredient.timestamp >= start,
+        ServingLogIngredient.timestamp < end
+    ).group_by(ServingLogIngredient.ingredient_id).subquery()
+    # noinspection PyTypeChecker
+    ingredients_used = db_session.query(Ingredient.name, Ingredient.unit, consumed.c.total_used) \
+        .join(consumed, consumed.c.ingredient_id == Ingredient.id) \
+        .order_by(desc(consumed.c.total_used)).all()
+    return [
+        {"name": item.name, "unit": item.unit, "total_used": item.total_used}
+        for item in ingredients_used
+    ]
+
+
+USAGE_REPORT_COLUMNS = ["timestamp", "meal_name", "user_name", "portions", "status", "failure_reason"]
+
 
+def iter_usage_report_rows(db_session: Session, report_start_date: str,
+                           report_end_date: str) -> Iterator[Dict[str, Any]]:
+    """Stream every serving in the range, oldest first, from a server-side cursor."""
+    start, end = _report_range(report_start_date, report_end_date)
+    # noinspection PyTypeChecker
+    query = db_session.query(
+        ServingLog.timestamp,
+        Meal.name.label("meal_name"),
+        User.name.label("user_name"),
+        ServingLog.portions,
+        ServingLog.status,
+        ServingLog.failure_reason
+    ).outerjoin(Meal, Meal.id == ServingLog.meal_id) \
+        .outerjoin(User, User.id == ServingLog.user_id) \
+        .filter(ServingLog.timestamp >= start, ServingLog.timestamp < end) \
+        .order_by(ServingLog.timestamp, ServingLog.id).yield_per(REPORT_BATCH_SIZE)
+    for row in query:
+        yield row._asdict()
+
+
+def generate_usage_report_data(db_session: Session, report_start_date: str, report_end_date: str) -> Dict[str, Any]:
+    """Generate usage report data."""
     return {
         "period": {"start": report_start_date, "end": report_end_date},
-        "total_meals_served": sum([log.portions for log in serving_logs]),
-        "success_rate": len([log for log in serving_logs if log.status == "success"]) / len(
-            serving_logs) if serving_logs else 0
-    }
\ No newline at end of file
+        **get_usage_report_totals(db_session, report_start_date, report_end_date),
+        "ingredients_used": get_usage_report_ingredients(db_session, report_start_date, report_end_date)
+    }
+
+
+def get_report_data_fingerprint(db_session: Session) -> str:
+    """A value that changes whenever data shown in reports changes, read in one query.
+
+    Servings only ever append, so the newest id covers them; the other tables are covered by
+    their row count (deletes) and newest updated_at (edits, including stock deductions).
+    """
+    # noinspection PyTypeChecker
+    row = db_session.execute(select(
+        select(func.max(ServingLog.id)).scalar_subquery(),
+        select(func.count(Ingredient.id)).scalar_subquery(),
+        select(func.max(Ingredient.updated_at)).scalar_subquery(),
+        select(func.count(Meal.id)).scalar_subquery(),
+        select(func.max(Meal.updated_at)).scalar_subquery(),
+        select(func.count(User.id)).scalar_subquery(),
+        select(func.max(User.updated_at)).scalar_subquery()
+    )).one()
+    return "|".join(str(value) for value in row)
+
+
+# Async variants for async endpoints. Each runs the function above through AsyncSession.run_sync,
+# so its SQL is awaited on the async driver (or runs in the threadpool without one).
+# create_user_db has none: bcrypt must not run inside run_sync, which executes on the event loop.
+def _async_variant(function):
+    @functools.wraps(function)
+    async def variant(db_session, *args, **kwargs):
+        # The function runs on the event loop with an AsyncSession, so Redis invalidations wait until after
+        async with deferred_invalidations():
+            return await db_session.run_sync(function, *args, **kwargs)
+    variant.__name__ = variant.__qualname__ = f"{function.__name__}_async"
+    return variant
+
+
+update_ingredient_db_async = _async_variant(update_ingredient_db)
+restock_ingredients_db_async = _async_variant(restock_ingredients_db)
+get_ingredient_levels_async = _async_variant(get_ingredient_levels)
+serve_meal_db_async = _async_variant(serve_meal_db)
+serve_meals_batch_db_async = _async_variant(serve_meals_batch_db)
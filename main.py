@@ -1,32 +1,50 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from pydantic import EmailStr
 import uvicorn
+import asyncio
 import json
 
-from database import engine, SessionLocal, Base
-from models import User
+from database import (
+    engine, get_db, get_read_db, get_async_db, async_session, get_pool_metrics, dispose_engines,
+    prefer_primary_reads, Base
+)
 from schemas import (
-    Token, UserCreate, UserResponse, UserUpdate,
-    IngredientCreate, IngredientResponse, IngredientUpdate,
+    Token, TokenRefresh, UserCreate, UserResponse, UserUpdate, UserRole,
+    IngredientCreate, IngredientResponse, IngredientUpdate, IngredientBulkResponse,
     MealCreate, MealResponse, MealUpdate,
     ServingCreate, ServingLogResponse,
-    SettingsUpdate, SettingsResponse
+    SettingsUpdate, SettingsResponse,
+    ReportJobCreate, ReportJobResponse
+)
+from auth import (
+    authenticate_user, create_access_token, create_refresh_token, refresh_tokens, user_claims,
+    get_current_user, get_current_user_async, require_roles, require_roles_async,
+    ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from auth import authenticate_user, create_access_token, get_current_user
 from crud import (
     get_user_by_email, get_users, create_user_db, update_user_db, delete_user_db,
-    get_ingredient, get_ingredients, create_ingredient_db, update_ingredient_db, delete_ingredient_db,
+    get_ingredient, get_ingredients, create_ingredient_db, update_ingredient_db_async, delete_ingredient_db,
+    restock_ingredients_db_async,
     get_meal, get_meals, create_meal_db, update_meal_db, delete_meal_db, calculate_max_portions,
-    serve_meal_db, get_serving_logs,
-    get_dashboard_stats, get_ingredient_usage_data, get_meal_popularity_data, get_waste_analysis_data,
+    calculate_all_max_portions,
+    get_ingredient_levels_async, serve_meal_db_async, serve_meals_batch_db_async, get_serving_logs,
+    get_dashboard_stats, dashboard_counters, utc_today,
+    get_ingredient_usage_data, get_meal_popularity_data, get_waste_analysis_data,
     get_system_settings, update_system_settings,
-    generate_inventory_report_data, generate_usage_report_data
+    generate_inventory_report_data, generate_usage_report_data, get_report_data_fingerprint
 )
-from websocket_manager import ConnectionManager
+from cache import analytics_cache, ANALYTICS_NAMESPACE
+from reports import MEDIA_TYPES, check_report_format, inventory_report, usage_report, stream_report
+from report_jobs import report_jobs
+from restock import read_restock_upload
+from backplane import BackplaneUnavailable
+from websocket_manager import ConnectionManager, IngredientDeltaStream, WILDCARD_TOPIC, ingredient_topic
 
 # Create tables
 Base.metadata.create_all(bind=engine)
@@ -44,6 +62,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # OAuth2 scheme
@@ -51,69 +70,77 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # WebSocket manager
 manager = ConnectionManager()
+async def load_ingredient_levels(ingredient_ids: list[int]) -> list[tuple[int, float, float]]:
+    async with async_session() as db:
+        return await get_ingredient_levels_async(db_session=db, ingredient_ids=ingredient_ids)
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Ingredient quantity changes are coalesced into delta frames instead of one message per change
+ingredient_deltas = IngredientDeltaStream(manager, load_ingredient_levels)
 
 # Authentication endpoints
 @app.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=30)
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data=user_claims(user), expires_delta=access_token_expires
     )
     return {
         "access_token": access_token,
+        "refresh_token": create_refresh_token(user),
         "token_type": "bearer",
         "user": UserResponse.model_validate(user)
     }
 
+@app.post("/token/refresh", response_model=Token)
+def refresh_access_token(
+    body: TokenRefresh,
+    db: Session = Depends(get_db)
+):
+    user, access_token, refresh_token = refresh_tokens(db, body.refresh_token)
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "user": user
+    }
+
 # User endpoints
-@app.post("/users/", response_model=UserResponse)
+@app.post("/users/", response_model=UserResponse, dependencies=[Depends(require_roles("admin"))])
 def create_user(
     user: UserCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db)
 ):
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
     db_user = get_user_by_email(db, email=str(user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
     return create_user_db(db_session=db, user=user)
 
-@app.get("/users/", response_model=list[UserResponse])
+@app.get("/users/", response_model=list[UserResponse], dependencies=[Depends(require_roles("admin", "manager"))])
 def read_users(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    after: str | None = None,
+    db: Session = Depends(get_read_db)
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
-    users = get_users(db_session=db, skip=skip, limit=limit)
+    users, next_cursor = get_users(db_session=db, skip=skip, limit=limit, after=after)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return users
 
 @app.get("/users/me", response_model=UserResponse)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: UserResponse = Depends(get_current_user_async)):
     return current_user
 
 @app.put("/users/{user_id}", response_model=UserResponse)
@@ -121,43 +148,64 @@ def update_user(
     user_id: int,
     user_update: UserUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user)
 ):
-    if current_user.role != "admin" and current_user.id != user_id:
+    if current_user.role != UserRole.admin and current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
     return update_user_db(db_session=db, user_id=user_id, user_update=user_update)
 
-@app.delete("/users/{user_id}")
+@app.delete("/users/{user_id}", dependencies=[Depends(require_roles("admin"))])
 def delete_user(
     user_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db)
 ):
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
     return delete_user_db(db_session=db, user_id=user_id)
 
 # Ingredient endpoints
-@app.post("/ingredients/", response_model=IngredientResponse)
+@app.post("/ingredients/", response_model=IngredientResponse, dependencies=[Depends(require_roles("admin", "manager"))])
 def create_ingredient(
     ingredient: IngredientCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db)
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
     return create_ingredient_db(db_session=db, ingredient=ingredient)
 
+@app.post("/ingredients/bulk", response_model=IngredientBulkResponse,
+          dependencies=[Depends(require_roles_async("admin", "manager"))])
+async def restock_ingredients(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    lines = await read_restock_upload(request)
+    created, updated = await restock_ingredients_db_async(db_session=db, lines=lines)
+
+    ingredients = created + updated
+    topics = ["ingredients", "analytics"]
+    if any(ingredient.quantity <= ingredient.threshold for ingredient in ingredients):
+        topics.append("low_stock")
+    await manager.publish(topics, {
+        "type": "ingredients_restocked",
+        "data": {
+            "lines": len(lines),
+            "created": [ingredient.id for ingredient in created],
+            "updated": [ingredient.id for ingredient in updated]
+        }
+    })
+    ingredient_deltas.note(ingredient.id for ingredient in ingredients)
+
+    return IngredientBulkResponse(created=created, updated=updated)
+
 @app.get("/ingredients/", response_model=list[IngredientResponse])
 def read_ingredients(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    after: str | None = None,
+    db: Session = Depends(get_read_db)
 ):
-    ingredients = get_ingredients(db_session=db, skip=skip, limit=limit)
+    ingredients, next_cursor = get_ingredients(db_session=db, skip=skip, limit=limit, after=after)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return ingredients
 
 @app.get("/ingredients/{ingredient_id}", response_model=IngredientResponse)
@@ -170,61 +218,68 @@ def read_ingredient(
         raise HTTPException(status_code=404, detail="Ingredient not found")
     return ingredient
 
-@app.put("/ingredients/{ingredient_id}", response_model=IngredientResponse)
+@app.put("/ingredients/{ingredient_id}", response_model=IngredientResponse,
+         dependencies=[Depends(require_roles_async("admin", "manager"))])
 async def update_ingredient(
     ingredient_id: int,
     ingredient_update: IngredientUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
-    updated_ingredient = update_ingredient_db(
+    updated_ingredient = await update_ingredient_db_async(
         db_session=db,
         ingredient_id=ingredient_id,
         ingredient_update=ingredient_update
     )
 
-    await manager.broadcast(json.dumps({
-        "type": "ingredient_updated",
-        "data": IngredientResponse.model_validate(updated_ingredient).model_dump()
-    }))
+    if updated_ingredient is None:
+        raise HTTPException(status_code=404, detail="Ingredient not found")
+
+    low_stock = updated_ingredient.quantity <= updated_ingredient.threshold
+    ingredient_deltas.note([ingredient_id])
+    # Quantity-only edits travel in the delta stream; other field changes still send the full row
+    if ingredient_update.model_dump(exclude_unset=True).keys() - {"quantity"}:
+        topics = ["ingredients", ingredient_topic(ingredient_id), "analytics"]
+        if low_stock:
+            topics.append("low_stock")
+        await manager.publish(topics, {
+            "type": "ingredient_updated",
+            "data": IngredientResponse.model_validate(updated_ingredient).model_dump(mode="json")
+        })
 
     return updated_ingredient
 
-@app.delete("/ingredients/{ingredient_id}")
+@app.delete("/ingredients/{ingredient_id}", dependencies=[Depends(require_roles("admin", "manager"))])
 def delete_ingredient(
     ingredient_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db)
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
     return delete_ingredient_db(db_session=db, ingredient_id=ingredient_id)
 
 # Meal endpoints
-@app.post("/meals/", response_model=MealResponse)
+@app.post("/meals/", response_model=MealResponse, dependencies=[Depends(require_roles("admin", "manager"))])
 def create_meal(
     meal: MealCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db)
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
     return create_meal_db(db_session=db, meal=meal)
 
 @app.get("/meals/", response_model=list[MealResponse])
 def read_meals(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    after: str | None = None,
+    db: Session = Depends(get_read_db)
 ):
-    meals = get_meals(db_session=db, skip=skip, limit=limit)
+    meals, next_cursor = get_meals(db_session=db, skip=skip, limit=limit, after=after)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return meals
 
+@app.get("/meals/max-portions")
+def get_all_meals_max_portions(db: Session = Depends(get_db)):
+    return calculate_all_max_portions(db_session=db)
+
 @app.get("/meals/{meal_id}", response_model=MealResponse)
 def read_meal(
     meal_id: int,
@@ -235,27 +290,22 @@ def read_meal(
         raise HTTPException(status_code=404, detail="Meal not found")
     return meal
 
-@app.put("/meals/{meal_id}", response_model=MealResponse)
+@app.put("/meals/{meal_id}", response_model=MealResponse, dependencies=[Depends(require_roles("admin", "manager"))])
 def update_meal(
     meal_id: int,
     meal_update: MealUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db)
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
-    return update_meal_db(db_session=db, meal_id=meal_id, meal_update=meal_update)
+    meal = update_meal_db(db_session=db, meal_id=meal_id, meal_update=meal_update)
+    if meal is None:
+        raise HTTPException(status_code=404, detail="Meal not found")
+    return meal
 
-@app.delete("/meals/{meal_id}")
+@app.delete("/meals/{meal_id}", dependencies=[Depends(require_roles("admin", "manager"))])
 def delete_meal(
     meal_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db)
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
     return delete_meal_db(db_session=db, meal_id=meal_id)
 
 @app.get("/meals/{meal_id}/max-portions")
@@ -269,103 +319,250 @@ def get_meal_max_portions(
 @app.post("/servings/", response_model=ServingLogResponse)
 async def serve_meal(
     serving: ServingCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserResponse = Depends(get_current_user_async)
 ):
-    serving_log = serve_meal_db(db_session=db, serving=serving, user_id=current_user.id)
+    serving_log, stock_levels = await serve_meal_db_async(db_session=db, serving=serving, user_id=current_user.id)
+    prefer_primary_reads(response)
 
-    await manager.broadcast(json.dumps({
+    await manager.publish(["servings", "analytics"], {
         "type": "meal_served",
-        "data": ServingLogResponse.model_validate(serving_log).model_dump()
-    }))
+        "data": serving_log.model_dump(mode="json")
+    })
+    ingredient_deltas.note(ingredient_id for ingredient_id, _, _ in stock_levels)
 
     return serving_log
 
+@app.post("/servings/batch", response_model=list[ServingLogResponse])
+async def serve_meals_batch(
+    servings: list[ServingCreate],
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserResponse = Depends(get_current_user_async)
+):
+    serving_logs, stock_levels = await serve_meals_batch_db_async(
+        db_session=db, servings=servings, user_id=current_user.id
+    )
+    prefer_primary_reads(response)
+
+    succeeded = [log for log in serving_logs if log.status == "success"]
+    await manager.publish(["servings", "analytics"], {
+        "type": "meals_served",
+        "data": {
+            "servings": len(serving_logs),
+            "succeeded": len(succeeded),
+            "failed": len(serving_logs) - len(succeeded),
+            "portions": sum(log.portions for log in succeeded),
+            "log_ids": [log.id for log in serving_logs]
+        }
+    })
+    ingredient_deltas.note(ingredient_id for ingredient_id, _, _ in stock_levels)
+
+    return serving_logs
+
 @app.get("/servings/", response_model=list[ServingLogResponse])
 def read_serving_logs(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    after: str | None = None,
+    db: Session = Depends(get_read_db)
 ):
-    logs = get_serving_logs(db_session=db, skip=skip, limit=limit)
+    logs, next_cursor = get_serving_logs(db_session=db, skip=skip, limit=limit, after=after)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return logs
 
 # Analytics endpoints
 @app.get("/analytics/dashboard")
-def get_dashboard_analytics(db: Session = Depends(get_db)):
-    return get_dashboard_stats(db_session=db)
+def get_dashboard_analytics(db: Session = Depends(get_read_db)):
+    if dashboard_counters.enabled:
+        # Live counters are already a constant-time read
+        return get_dashboard_stats(db_session=db)
+    return analytics_cache.get_or_compute(
+        ANALYTICS_NAMESPACE, ("dashboard", utc_today()), lambda: get_dashboard_stats(db_session=db)
+    )
 
 @app.get("/analytics/ingredient-usage")
 def get_ingredient_usage_analytics(
     days: int = 30,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    return get_ingredient_usage_data(db_session=db, days=days)
+    return analytics_cache.get_or_compute(
+        ANALYTICS_NAMESPACE, ("ingredient-usage", days), lambda: get_ingredient_usage_data(db_session=db, days=days)
+    )
 
 @app.get("/analytics/meal-popularity")
 def get_meal_popularity_analytics(
     days: int = 30,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    return get_meal_popularity_data(db_session=db, days=days)
+    return analytics_cache.get_or_compute(
+        ANALYTICS_NAMESPACE, ("meal-popularity", days), lambda: get_meal_popularity_data(db_session=db, days=days)
+    )
 
 @app.get("/analytics/waste-analysis")
 def get_waste_analysis(
     days: int = 30,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    return get_waste_analysis_data(db_session=db, days=days)
+    return analytics_cache.get_or_compute(
+        ANALYTICS_NAMESPACE, ("waste-analysis", days), lambda: get_waste_analysis_data(db_session=db, days=days)
+    )
 
 # Settings endpoints
-@app.get("/settings/", response_model=SettingsResponse)
+@app.get("/settings/", response_model=SettingsResponse, dependencies=[Depends(require_roles("admin", "manager"))])
 def get_settings(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db)
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
     return get_system_settings(db_session=db)
 
-@app.put("/settings/", response_model=SettingsResponse)
+@app.put("/settings/", response_model=SettingsResponse, dependencies=[Depends(require_roles("admin"))])
 def update_settings(
     settings: SettingsUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db)
 ):
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Not enough permissions")
-
     return update_system_settings(db_session=db, settings=settings)
 
 # Reports endpoints
 @app.get("/reports/inventory")
-def generate_inventory_report(db: Session = Depends(get_db)):
-    return generate_inventory_report_data(db_session=db)
+def generate_inventory_report(
+    report_format: str = Query("json", alias="format"),
+    db: Session = Depends(get_read_db)
+):
+    check_report_format(report_format)
+    if report_format == "json":
+        return generate_inventory_report_data(db_session=db)
+    return stream_report(report_format, inventory_report(db_session=db))
 
 @app.get("/reports/usage")
 def generate_usage_report(
     start_date: str,
     end_date: str,
+    report_format: str = Query("json", alias="format"),
+    db: Session = Depends(get_read_db)
+):
+    check_report_format(report_format)
+    if report_format == "json":
+        return generate_usage_report_data(
+            db_session=db,
+            report_start_date=start_date,
+            report_end_date=end_date
+        )
+    return stream_report(report_format, usage_report(db_session=db, start_date=start_date, end_date=end_date))
+
+@app.post("/reports/jobs", response_model=ReportJobResponse, status_code=status.HTTP_202_ACCEPTED)
+def create_report_job(
+    job: ReportJobCreate,
     db: Session = Depends(get_db)
 ):
-    return generate_usage_report_data(
-        db_session=db,
-        report_start_date=start_date,
-        report_end_date=end_date
-    )
+    check_report_format(job.format)
+    if job.report == "usage" and not (job.start_date and job.end_date):
+        raise HTTPException(status_code=400, detail="Usage reports need start_date and end_date")
+    # Fingerprinted on the primary so a lagging replica cannot match an artifact built from older data
+    return report_jobs.submit(job, get_report_data_fingerprint(db_session=db)).to_response()
+
+@app.get("/reports/jobs/{job_id}", response_model=ReportJobResponse)
+def read_report_job(job_id: str):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return job.to_response()
+
+@app.get("/reports/jobs/{job_id}/download")
+def download_report_job(job_id: str):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Report job is {job.status}")
+    return FileResponse(job.path, media_type=MEDIA_TYPES[job.params.format], filename=job.filename)
 
 # WebSocket endpoint
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, topics: str | None = None):
+    # Clients pick topics with ?topics=servings,low_stock; without it they receive every event
+    initial_topics = [topic for topic in (topics or "").split(",") if topic] or [WILDCARD_TOPIC]
+    await manager.connect(websocket, topics=initial_topics)
     try:
         while True:
             data = await websocket.receive_text()
-            await manager.broadcast(data)
+            await handle_websocket_message(websocket, data)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Any other error also ends the connection; its writer task and queue must not outlive it
         manager.disconnect(websocket)
 
+async def handle_websocket_message(websocket: WebSocket, data: str):
+    """Handle a client control message: subscribe, unsubscribe, snapshot or ping."""
+    try:
+        message = json.loads(data)
+        action = message.get("action")
+        topics = message.get("topics", [])
+    except (ValueError, AttributeError):
+        action, topics = None, []
+
+    client = manager.active_connections.get(websocket)
+    if client is None:
+        # Already dropped, e.g. as a slow client; the receive loop ends on the next read
+        return
+
+    if action in ("subscribe", "unsubscribe") and not isinstance(topics, list):
+        reply = {"type": "error", "detail": "topics must be a list of topic names"}
+    elif action == "subscribe":
+        # Entries that are not known topic names, including non-strings, come back as rejected
+        rejected = manager.subscribe(websocket, topics)
+        reply = {"type": "subscribed", "topics": sorted(client.topics)}
+        if rejected:
+            reply["rejected"] = rejected
+    elif action == "unsubscribe":
+        rejected = manager.unsubscribe(websocket, topics)
+        reply = {"type": "unsubscribed", "topics": sorted(client.topics)}
+        if rejected:
+            reply["rejected"] = rejected
+    elif action == "snapshot":
+        try:
+            # Stamp the snapshot before reading so deltas sent meanwhile carry a higher seq
+            seq = await ingredient_deltas.current_sequence()
+        except BackplaneUnavailable:
+            reply = {"type": "error", "detail": "Snapshot unavailable, try again shortly"}
+        else:
+            async with async_session() as db:
+                levels = await get_ingredient_levels_async(db_session=db)
+            reply = {
+                "type": "ingredient_snapshot",
+                "seq": seq,
+                "ingredients": [[ingredient_id, quantity] for ingredient_id, quantity, _ in levels]
+            }
+    elif action == "ping":
+        reply = {"type": "pong"}
+    else:
+        reply = {"type": "error",
+                 "detail": "Expected a JSON object with action subscribe, unsubscribe, snapshot or ping"}
+    await manager.send_personal_message(json.dumps(reply), websocket)
+
+@app.get("/metrics/websocket", dependencies=[Depends(require_roles("admin", "manager"))])
+def get_websocket_metrics():
+    return manager.metrics()
+
+@app.get("/metrics/db-pool", dependencies=[Depends(require_roles("admin", "manager"))])
+def get_db_pool_metrics():
+    return get_pool_metrics()
+
+@app.on_event("startup")
+async def start_websockets():
+    await manager.start()
+    report_jobs.attach(asyncio.get_running_loop(), manager.publish)
+
+@app.on_event("shutdown")
+async def shutdown_websockets():
+    await ingredient_deltas.shutdown()
+    await report_jobs.shutdown()
+    await manager.shutdown()
+    await dispose_engines()
+
 # Health check
 @app.get("/health")
 def health_check():
@@ -1,11 +1,11 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Enum
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Text, Enum, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime, UTC
 import enum
 
-Base = declarative_base()
+# Share the Base from database.py so Base.metadata.create_all() in main.py sees these tables
+from database import Base
 
 class UserRole(str, enum.Enum):
     admin = "admin"
@@ -62,8 +62,8 @@ class MealIngredient(Base):
     __tablename__ = "meal_ingredients"
 
     id = Column(Integer, primary_key=True, index=True)
-    meal_id = Column(Integer, ForeignKey("meals.id"))
-    ingredient_id = Column(Integer, ForeignKey("ingredients.id"))
+    meal_id = Column(Integer, ForeignKey("meals.id"), index=True)
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), index=True)
     quantity = Column(Float)
     unit = Column(String)
 
@@ -83,6 +83,67 @@ class ServingLog(Base):
 
     meal = relationship("Meal", back_populates="serving_logs")
     user = relationship("User", back_populates="serving_logs")
+    consumed_ingredients = relationship("ServingLogIngredient", back_populates="serving_log",
+                                        cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # Keyset pagination walks serving logs by (timestamp, id)
+        Index("ix_serving_logs_timestamp_id", "timestamp", "id"),
+        # Analytics filter by status or meal over a time range
+        Index("ix_serving_logs_status_timestamp", "status", "timestamp"),
+        Index("ix_serving_logs_meal_id_timestamp", "meal_id", "timestamp"),
+    )
+
+class ServingLogIngredient(Base):
+    """Quantity of an ingredient a successful serving actually consumed.
+
+    Recipes can change after the fact, so analytics read these rows instead of joining the
+    current recipe. The serving timestamp is copied here so usage over a time range is a
+    scan of this table alone. Rows are deleted with their serving or ingredient.
+    """
+    __tablename__ = "serving_log_ingredients"
+
+    id = Column(Integer, primary_key=True, index=True)
+    serving_log_id = Column(Integer, ForeignKey("serving_logs.id", ondelete="CASCADE"),
+                            nullable=False, index=True)
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id", ondelete="CASCADE"), nullable=False)
+    quantity = Column(Float, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+
+    serving_log = relationship("ServingLog", back_populates="consumed_ingredients")
+
+    __table_args__ = (
+        Index("ix_serving_log_ingredients_timestamp_ingredient", "timestamp", "ingredient_id"),
+    )
+
+class DailyIngredientUsage(Base):
+    """Quantity of each ingredient consumed by successful servings, per UTC day.
+
+    Rows go with their ingredient when it is deleted; analytics only report existing ones.
+    """
+    __tablename__ = "daily_ingredient_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id", ondelete="CASCADE"), nullable=False)
+    quantity = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("day", "ingredient_id", name="uq_daily_ingredient_usage_day_ingredient"),
+    )
+
+class DailyMealPortions(Base):
+    """Portions of each meal served successfully, per UTC day; deleted along with the meal."""
+    __tablename__ = "daily_meal_portions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)
+    meal_id = Column(Integer, ForeignKey("meals.id", ondelete="CASCADE"), nullable=False)
+    portions = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("day", "meal_id", name="uq_daily_meal_portions_day_meal"),
+    )
 
 class Settings(Base):
     __tablename__ = "settings"
@@ -0,0 +1,435 @@
+# report_jobs.py
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+from fastapi import HTTPException
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+
+from database import SessionLocal
+from crud import generate_inventory_report_data, generate_usage_report_data
+from reports import inventory_report, report_chunks, usage_report
+from schemas import ReportJobCreate, ReportJobResponse
+
+# "local" runs jobs on a thread pool in this process, "celery" sends them to Celery workers
+REPORT_JOBS_BACKEND = os.getenv("REPORT_JOBS_BACKEND", "local")
+REPORT_JOBS_WORKERS = int(os.getenv("REPORT_JOBS_WORKERS", "2"))
+# Finished artifacts are kept here; with Celery it must be shared by the API and the workers
+REPORT_JOBS_DIR = os.getenv("REPORT_JOBS_DIR", os.path.join(tempfile.gettempdir(), "kindergarten-reports"))
+# Oldest finished jobs and their files are dropped beyond this many jobs
+REPORT_JOBS_MAX = int(os.getenv("REPORT_JOBS_MAX", "100"))
+# Set to redis://host:6379/0 to share job states between workers; required with more than one
+REPORT_JOBS_URL = os.getenv("REPORT_JOBS_URL", "")
+# memory:// runs tasks eagerly in the caller, which is enough for tests
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "memory://")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "cache+memory://")
+# How often Celery job states are polled to push progress to WebSocket clients
+REPORT_JOBS_POLL_SECONDS = float(os.getenv("REPORT_JOBS_POLL_SECONDS", "1"))
+
+# Progress is reported every this many rows and published in steps of at least PROGRESS_STEP
+PROGRESS_ROWS = 1000
+PROGRESS_STEP = 0.05
+
+logger = logging.getLogger(__name__)
+
+Publisher = Callable[[Iterable[str], Dict[str, Any]], Awaitable[None]]
+
+
+def _counted(rows: Iterable[Dict[str, Any]], total: int, progress: Callable[[float], None]) -> Iterator[Dict[str, Any]]:
+    for count, row in enumerate(rows, 1):
+        if count % PROGRESS_ROWS == 0 and total:
+            progress(min(count / total, 0.99))
+        yield row
+
+
+def build_report(report: str, report_format: str, start_date: Optional[str], end_date: Optional[str],
+                 path: str, progress: Callable[[float], None]):
+    """Render a report into a file with its own database session, reporting progress on the way.
+
+    Rendered on the primary, where the job's fingerprint is taken, so an artifact never holds
+    older data than the fingerprint it is reused under.
+    """
+    db_session = SessionLocal()
+    try:
+        if report_format == "json":
+            if report == "inventory":
+                data = generate_inventory_report_data(db_session)
+            else:
+                data = generate_usage_report_data(db_session, start_date, end_date)
+            chunks: Iterable[str | bytes] = [json.dumps(data, default=str)]
+        else:
+            if report == "inventory":
+                built = inventory_report(db_session)
+            else:
+                built = usage_report(db_session, start_date, end_date)
+            detail = built.tables[-1]
+            built.tables[-1] = detail._replace(rows=_counted(detail.rows, built.row_count, progress))
+            chunks = report_chunks(report_format, built)
+
+        # Written under a temporary name so a half-written file is never downloaded
+        partial = path + ".part"
+        with open(partial, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        os.replace(partial, path)
+    finally:
+        db_session.close()
+
+
+def _create_celery_app():
+    from celery import Celery
+
+    app = Celery("report_jobs", broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+    if CELERY_BROKER_URL.startswith("memory://"):
+        # Nothing consumes an in-memory broker, so run tasks in the caller
+        app.conf.task_always_eager = True
+        app.conf.task_store_eager_result = True
+
+    @app.task(bind=True, name="report_jobs.build_report")
+    def build_report_task(task, report, report_format, start_date, end_date, path):
+        try:
+            build_report(report, report_format, start_date, end_date, path,
+                         lambda progress: task.update_state(state="PROGRESS", meta={"progress": progress}))
+        except HTTPException as exc:
+            # Result backends store plain exceptions more faithfully than HTTPException
+            raise ValueError(exc.detail) from None
+
+    return app
+
+
+# Start workers with: celery -A report_jobs.celery_app worker
+celery_app = _create_celery_app() if REPORT_JOBS_BACKEND == "celery" else None
+
+
+class ReportJob:
+    """A requested report and where its rendering stands."""
+
+    def __init__(self, params: ReportJobCreate, fingerprint: str, directory: str, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.params = params
+        self.fingerprint = fingerprint
+        # Same parameters over the same data give the same artifact
+        self.key = (params.report.value, params.format, params.start_date, params.end_date, fingerprint)
+        self.path = os.path.join(directory, f"{self.id}.{params.format}")
+        self.status = "queued"
+        self.progress = 0.0
+        self.published_progress = 0.0
+        self.error: Optional[str] = None
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    @property
+    def filename(self) -> str:
+        return f"{self.params.report.value}-report.{self.params.format}"
+
+    def finish(self, error: Optional[str] = None):
+        self.status = "failed" if error else "done"
+        self.error = error
+        if not error:
+            self.progress = 1.0
+        self.finished_at = datetime.now(timezone.utc)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "params": self.params.model_dump(mode="json"),
+            "fingerprint": self.fingerprint,
+            "path": self.path,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ReportJob":
+        job = cls(ReportJobCreate.model_validate(data["params"]), data["fingerprint"],
+                  os.path.dirname(data["path"]), job_id=data["id"])
+        job.status = data["status"]
+        job.progress = job.published_progress = data["progress"]
+        job.error = data["error"]
+        job.created_at = datetime.fromisoformat(data["created_at"])
+        job.finished_at = datetime.fromisoformat(data["finished_at"]) if data["finished_at"] else None
+        return job
+
+    def to_response(self) -> ReportJobResponse:
+        return ReportJobResponse(
+            id=self.id,
+            report=self.params.report,
+            format=self.params.format,
+            start_date=self.params.start_date,
+            end_date=self.params.end_date,
+            status=self.status,
+            progress=round(self.progress, 3),
+            error=self.error,
+            created_at=self.created_at,
+            finished_at=self.finished_at,
+            download_url=f"/reports/jobs/{self.id}/download" if self.status == "done" else None
+        )
+
+
+class MemoryReportJobStore:
+    """Jobs held in this process; other workers cannot see them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs: "OrderedDict[str, ReportJob]" = OrderedDict()
+
+    def claim(self, candidate: ReportJob, max_jobs: int) -> Tuple[ReportJob, list[ReportJob]]:
+        """Store the candidate unless a live job has the same key.
+
+        Returns the job to use and the finished jobs evicted to stay within max_jobs.
+        """
+        with self.lock:
+            for job in reversed(self.jobs.values()):
+                if job.key == candidate.key and job.status != "failed":
+                    return job, []
+            self.jobs[candidate.id] = candidate
+            evicted = []
+            for job_id in list(self.jobs):
+                if len(self.jobs) <= max_jobs:
+                    break
+                if self.jobs[job_id].finished:
+                    evicted.append(self.jobs.pop(job_id))
+            return candidate, evicted
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        return self.jobs.get(job_id)
+
+    def save(self, job: ReportJob):
+        # Callers change the stored job itself
+        pass
+
+
+class RedisReportJobStore:
+    """Jobs shared by all workers, stored as JSON, so any worker can answer for any job."""
+
+    def __init__(self, url: str = REPORT_JOBS_URL, prefix: str = "kindergarten:report-jobs:", client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        # Job ids ordered by creation time, for eviction
+        self.index = f"{prefix}index"
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}job:{job_id}"
+
+    def _claim_key(self, job: ReportJob) -> str:
+        digest = hashlib.sha256(json.dumps(job.key).encode()).hexdigest()
+        return f"{self.prefix}key:{digest}"
+
+    def claim(self, candidate: ReportJob, max_jobs: int) -> Tuple[ReportJob, list[ReportJob]]:
+        """Store the candidate unless a live job has the same key; see MemoryReportJobStore.claim."""
+        self.client.set(self._job_key(candidate.id), json.dumps(candidate.to_dict()))
+        self.client.zadd(self.index, {candidate.id: candidate.created_at.timestamp()})
+        claim_key = self._claim_key(candidate)
+        if not self.client.set(claim_key, candidate.id, nx=True):
+            existing_id = self.client.get(claim_key)
+            existing = self.get(existing_id.decode()) if existing_id else None
+            if existing is not None and existing.status != "failed":
+                self._delete(candidate)
+                return existing, []
+            # The matching job failed or was evicted, so the candidate takes its place
+            self.client.set(claim_key, candidate.id)
+        return candidate, self._evict(max_jobs)
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        raw = self.client.get(self._job_key(job_id))
+        return None if raw is None else ReportJob.from_dict(json.loads(raw))
+
+    def save(self, job: ReportJob):
+        # xx: a job evicted meanwhile stays evicted
+        self.client.set(self._job_key(job.id), json.dumps(job.to_dict()), xx=True)
+
+    def _delete(self, job: ReportJob):
+        self.client.delete(self._job_key(job.id))
+        self.client.zrem(self.index, job.id)
+        claim_key = self._claim_key(job)
+        if self.client.get(claim_key) == job.id.encode():
+            self.client.delete(claim_key)
+
+    def _evict(self, max_jobs: int) -> list[ReportJob]:
+        excess = self.client.zcard(self.index) - max_jobs
+        if excess <= 0:
+            return []
+        evicted = []
+        for raw_id in self.client.zrange(self.index, 0, -1):
+            if excess <= 0:
+                break
+            job = self.get(raw_id.decode())
+            if job is None:
+                # Already evicted by another worker
+                self.client.zrem(self.index, raw_id)
+                excess -= 1
+            elif job.finished:
+                self._delete(job)
+                evicted.append(job)
+                excess -= 1
+        return evicted
+
+
+def create_job_store(url: str = REPORT_JOBS_URL):
+    """Pick the job store from the configured URL; no URL keeps jobs in this process."""
+    return RedisReportJobStore(url) if url else MemoryReportJobStore()
+
+
+class ReportJobQueue:
+    """Runs report jobs in the background and remembers their artifacts.
+
+    Submitting parameters that match a queued, running or finished job over unchanged data
+    returns that job instead of rendering the report again. Job changes are published to the
+    "reports" WebSocket topic once attach() has been given the event loop.
+    """
+
+    def __init__(self, directory: str = REPORT_JOBS_DIR, workers: int = REPORT_JOBS_WORKERS,
+                 max_jobs: int = REPORT_JOBS_MAX, store=None):
+        self.directory = directory
+        self.max_jobs = max_jobs
+        self.store = store or create_job_store()
+        # Celery jobs submitted by this process, whose states the watcher polls
+        self.watching: Set[str] = set()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-job") \
+            if celery_app is None else None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.publish: Optional[Publisher] = None
+        self.watcher: Optional[asyncio.Task] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def attach(self, loop: asyncio.AbstractEventLoop, publish: Publisher):
+        """Publish job events on this loop; with Celery also start polling job states."""
+        self.loop = loop
+        self.publish = publish
+        if celery_app is not None and self.watcher is None:
+            self.watcher = loop.create_task(self._watch())
+
+    def submit(self, params: ReportJobCreate, fingerprint: str) -> ReportJob:
+        candidate = ReportJob(params, fingerprint, self.directory)
+        job, evicted = self.store.claim(candidate, self.max_jobs)
+        for old_job in evicted:
+            self._remove_file(old_job)
+        if job is not candidate:
+            return job
+
+        if celery_app is not None:
+            celery_app.tasks["report_jobs.build_report"].apply_async(
+                args=(params.report.value, params.format, params.start_date, params.end_date, job.path),
+                task_id=job.id
+            )
+            self.watching.add(job.id)
+            self._refresh(job)
+        else:
+            self.executor.submit(self._run, job)
+        self._notify(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        job = self.store.get(job_id)
+        if job is not None:
+            self._refresh(job)
+        return job
+
+    @staticmethod
+    def _remove_file(job: ReportJob):
+        try:
+            os.remove(job.path)
+        except FileNotFoundError:
+            pass
+
+    def _run(self, job: ReportJob):
+        job.status = "running"
+        self.store.save(job)
+        self._notify(job)
+        try:
+            build_report(job.params.report.value, job.params.format, job.params.start_date,
+                         job.params.end_date, job.path, lambda progress: self._progress(job, progress))
+        except HTTPException as exc:
+            job.finish(error=exc.detail)
+        except Exception as exc:
+            logger.exception("Report job %s failed", job.id)
+            job.finish(error=str(exc) or type(exc).__name__)
+        else:
+            job.finish()
+        self.store.save(job)
+        self._notify(job)
+
+    def _progress(self, job: ReportJob, progress: float):
+        job.progress = progress
+        if progress - job.published_progress >= PROGRESS_STEP:
+            self.store.save(job)
+            self._notify(job)
+
+    def _refresh(self, job: ReportJob):
+        """Copy the Celery task state into the job, storing it if it changed."""
+        if celery_app is None or job.finished:
+            return
+        before = (job.status, job.progress)
+        result = celery_app.AsyncResult(job.id)
+        if result.state in ("STARTED", "PROGRESS"):
+            job.status = "running"
+            if isinstance(result.info, dict):
+                job.progress = result.info.get("progress", job.progress)
+        elif result.state == "SUCCESS":
+            job.finish()
+        elif result.state == "FAILURE":
+            job.finish(error=str(result.info))
+        if (job.status, job.progress) != before:
+            self.store.save(job)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(REPORT_JOBS_POLL_SECONDS)
+            for job_id in list(self.watching):
+                try:
+                    job = await asyncio.to_thread(self.store.get, job_id)
+                    if job is None:
+                        self.watching.discard(job_id)
+                        continue
+                    before = (job.status, job.progress)
+                    await asyncio.to_thread(self._refresh, job)
+                except Exception:
+                    logger.exception("Could not read the state of report job %s", job_id)
+                    continue
+                if job.finished:
+                    self.watching.discard(job_id)
+                if (job.status, job.progress) != before:
+                    self._notify(job)
+
+    def _notify(self, job: ReportJob):
+        """Publish the job state; safe to call from worker threads."""
+        if self.loop is None or self.loop.is_closed():
+            return
+        job.published_progress = job.progress
+        event = {"type": "report_job", "job": job.to_response().model_dump(mode="json")}
+        coroutine = self.publish(["reports"], event)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.loop.create_task(coroutine)
+        else:
+            asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def shutdown(self):
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+report_jobs = ReportJobQueue()
@@ -0,0 +1,177 @@
+# reports.py
+from typing import Any, Dict, Iterable, Iterator, NamedTuple
+from tempfile import SpooledTemporaryFile
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from crud import (
+    get_inventory_report_totals, iter_inventory_report_rows, INVENTORY_REPORT_COLUMNS,
+    get_usage_report_totals, get_usage_report_ingredients, iter_usage_report_rows, USAGE_REPORT_COLUMNS
+)
+import csv
+import io
+import json
+
+REPORT_FORMATS = ("json", "csv", "ndjson", "xlsx", "pdf")
+MEDIA_TYPES = {
+    "json": "application/json",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pdf": "application/pdf",
+}
+# Text output is flushed to the client in chunks of about this many bytes
+CHUNK_SIZE = 64 * 1024
+# Built files stay in memory up to this size, then spill to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+class ReportTable(NamedTuple):
+    """A titled table of report rows; printable tables are also rendered into PDFs."""
+    title: str
+    columns: list[str]
+    rows: Iterable[Dict[str, Any]]
+    printable: bool = True
+
+
+class Report(NamedTuple):
+    """A report ready to render: file name, title, summary figures and tables.
+
+    row_count is the number of rows in the last (most detailed) table.
+    """
+    name: str
+    title: str
+    summary: Dict[str, Any]
+    tables: list[ReportTable]
+    row_count: int
+
+
+def inventory_report(db_session: Session) -> Report:
+    totals = get_inventory_report_totals(db_session)
+    return Report("inventory-report", "Inventory report", totals, [
+        ReportTable("Ingredients", INVENTORY_REPORT_COLUMNS, iter_inventory_report_rows(db_session))
+    ], totals["total_items"])
+
+
+def usage_report(db_session: Session, start_date: str, end_date: str) -> Report:
+    totals = get_usage_report_totals(db_session, start_date, end_date)
+    summary = {"period": f"{start_date} - {end_date}", **totals}
+    ingredients_used = get_usage_report_ingredients(db_session, start_date, end_date)
+    return Report("usage-report", "Usage report", summary, [
+        ReportTable("Ingredients used", ["name", "unit", "total_used"], ingredients_used),
+        # Every serving in the range; too long to print, so PDFs show only the totals
+        ReportTable("Servings", USAGE_REPORT_COLUMNS, iter_usage_report_rows(db_session, start_date, end_date),
+                    printable=False)
+    ], totals["total_servings"])
+
+
+def check_report_format(report_format: str):
+    """Reject unknown formats before any query runs."""
+    if report_format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of: {', '.join(REPORT_FORMATS)}")
+
+
+def _csv_chunks(table: ReportTable) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(table.columns)
+    for row in table.rows:
+        writer.writerow([row[column] for column in table.columns])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(table: ReportTable) -> Iterator[str]:
+    lines = []
+    size = 0
+    for row in table.rows:
+        line = json.dumps({column: row[column] for column in table.columns}, default=str) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(lines)
+            lines, size = [], 0
+    yield "".join(lines)
+
+
+def _file_chunks(file) -> Iterator[bytes]:
+    file.seek(0)
+    while chunk := file.read(CHUNK_SIZE):
+        yield chunk
+
+
+def _xlsx_chunks(summary: Dict[str, Any], tables: list[ReportTable]) -> Iterator[bytes]:
+    from openpyxl import Workbook
+
+    # Write-only sheets stream rows to disk instead of keeping cells in memory
+    workbook = Workbook(write_only=True)
+    summary_sheet = workbook.create_sheet("Summary")
+    for key, value in summary.items():
+        summary_sheet.append([key, str(value) if isinstance(value, dict) else value])
+    for table in tables:
+        sheet = workbook.create_sheet(table.title[:31])
+        sheet.append(table.columns)
+        for row in table.rows:
+            sheet.append([row[column] for column in table.columns])
+
+    with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as file:
+        workbook.save(file)
+        yield from _file_chunks(file)
+
+
+def _pdf_chunks(title: str, summary: Dict[str, Any], tables: list[ReportTable]) -> Iterator[bytes]:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    styles = getSampleStyleSheet()
+    story = [Paragraph(title, styles["Title"])]
+    for key, value in summary.items():
+        story.append(Paragraph(f"<b>{key.replace('_', ' ').capitalize()}:</b> {value}", styles["Normal"]))
+
+    for table in tables:
+        if not table.printable:
+            continue
+        data = [table.columns] + [[row[column] for column in table.columns] for row in table.rows]
+        pdf_table = Table(data, repeatRows=1)
+        pdf_table.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+            ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+            ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ]))
+        story += [Spacer(1, 12), Paragraph(table.title, styles["Heading2"]), pdf_table]
+
+    with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as file:
+        SimpleDocTemplate(file, pagesize=A4, title=title).build(story)
+        yield from _file_chunks(file)
+
+
+def report_chunks(report_format: str, report: Report) -> Iterator[str | bytes]:
+    """Render a report lazily, chunk by chunk.
+
+    CSV and NDJSON contain only the last (most detailed) table, row by row. XLSX gets a summary
+    sheet plus one sheet per table. PDF renders the summary and the printable tables.
+    """
+    check_report_format(report_format)
+    if report_format == "csv":
+        return _csv_chunks(report.tables[-1])
+    if report_format == "ndjson":
+        return _ndjson_chunks(report.tables[-1])
+    if report_format == "xlsx":
+        return _xlsx_chunks(report.summary, report.tables)
+    if report_format == "pdf":
+        return _pdf_chunks(report.title, report.summary, report.tables)
+    raise HTTPException(status_code=400, detail="JSON reports are not rendered in chunks")
+
+
+def stream_report(report_format: str, report: Report) -> StreamingResponse:
+    """Stream a report as a file download."""
+    return StreamingResponse(
+        report_chunks(report_format, report),
+        media_type=MEDIA_TYPES[report_format],
+        headers={"Content-Disposition": f'attachment; filename="{report.name}.{report_format}"'}
+    )
@@ -0,0 +1,112 @@
+# restock.py
+from typing import Any, Dict, Iterator
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from schemas import IngredientRestock
+import csv
+import io
+import json
+import os
+
+# Upper bound on the lines of one delivery upload
+RESTOCK_MAX_LINES = int(os.getenv("RESTOCK_MAX_LINES", "5000"))
+
+UPLOAD_FORMATS = {
+    "application/json": "json",
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+}
+UPLOAD_EXTENSIONS = {"json": "json", "csv": "csv", "xlsx": "xlsx"}
+
+
+def _upload_format(content_type: str, filename: str = "") -> str:
+    upload_format = UPLOAD_FORMATS.get(content_type.split(";")[0].strip().lower())
+    if upload_format is None and "." in filename:
+        upload_format = UPLOAD_EXTENSIONS.get(filename.rsplit(".", 1)[1].lower())
+    if upload_format is None:
+        raise HTTPException(status_code=415, detail="Upload a JSON array, a CSV file or an XLSX workbook")
+    return upload_format
+
+
+def _json_rows(data: bytes) -> list[Any]:
+    try:
+        rows = json.loads(data)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of lines")
+    return rows
+
+
+def _csv_rows(data: bytes) -> Iterator[Dict[str, Any]]:
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV files must be UTF-8")
+    yield from csv.DictReader(io.StringIO(text))
+
+
+def _xlsx_rows(data: bytes) -> Iterator[Dict[str, Any]]:
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid XLSX workbook")
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(cell).strip().lower() if cell is not None else "" for cell in next(rows, ())]
+        for row in rows:
+            yield dict(zip(header, row))
+    finally:
+        workbook.close()
+
+
+def parse_restock_lines(content_type: str, data: bytes, filename: str = "") -> list[IngredientRestock]:
+    """Read delivery lines from a JSON array, or a CSV/XLSX table with a header row.
+
+    Column names match the IngredientRestock fields; empty cells and blank rows are skipped.
+    """
+    upload_format = _upload_format(content_type, filename)
+    if upload_format == "json":
+        rows = _json_rows(data)
+    elif upload_format == "csv":
+        rows = _csv_rows(data)
+    else:
+        rows = _xlsx_rows(data)
+
+    lines = []
+    for number, row in enumerate(rows, 1):
+        if isinstance(row, dict) and upload_format != "json":
+            row = {key.strip().lower(): value for key, value in row.items()
+                   if key and value is not None and str(value).strip() != ""}
+            if not row:
+                continue
+        try:
+            lines.append(IngredientRestock.model_validate(row))
+        except ValidationError as exc:
+            error = exc.errors()[0]
+            field = ".".join(str(part) for part in error["loc"])
+            raise HTTPException(status_code=400, detail=f"Line {number}: {field}: {error['msg']}")
+        if len(lines) > RESTOCK_MAX_LINES:
+            raise HTTPException(status_code=413, detail=f"At most {RESTOCK_MAX_LINES} lines per upload")
+    return lines
+
+
+async def read_restock_upload(request: Request) -> list[IngredientRestock]:
+    """Parse the request body, or the "file" field of a multipart form, into delivery lines.
+
+    Parsing runs in the threadpool since workbooks take a while.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Send the delivery as the \"file\" field")
+        return await run_in_threadpool(
+            parse_restock_lines, upload.content_type or "", await upload.read(), upload.filename or ""
+        )
+    return await run_in_threadpool(parse_restock_lines, content_type, await request.body())
@@ -1,5 +1,5 @@
 # schemas.py
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional
 from datetime import datetime
 from enum import Enum
@@ -13,6 +13,10 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     user: 'UserResponse'
+    refresh_token: Optional[str] = None
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     email: Optional[str] = None
@@ -68,6 +72,23 @@ class IngredientResponse(IngredientBase):
     class Config:
         from_attributes = True
 
+class IngredientRestock(BaseModel):
+    """One line of a delivery: quantity is added to the stock of the ingredient with this name.
+
+    The other fields overwrite the stored values when given and are required for new ingredients.
+    """
+    name: str
+    quantity: float = Field(gt=0)
+    unit: Optional[str] = None
+    threshold: Optional[float] = Field(None, ge=0)
+    category: Optional[str] = None
+    cost: Optional[float] = Field(None, ge=0)
+    delivery_date: Optional[datetime] = None
+
+class IngredientBulkResponse(BaseModel):
+    created: List[IngredientResponse]
+    updated: List[IngredientResponse]
+
 class MealIngredientBase(BaseModel):
     ingredient_id: int
     quantity: float
@@ -149,3 +170,26 @@ class SettingsUpdate(BaseModel):
 class SettingsResponse(SettingsBase):
     class Config:
         from_attributes = True
+
+class ReportType(str, Enum):
+    inventory = "inventory"
+    usage = "usage"
+
+class ReportJobCreate(BaseModel):
+    report: ReportType
+    format: str = "csv"
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+
+class ReportJobResponse(BaseModel):
+    id: str
+    report: ReportType
+    format: str
+    start_date: Optional[str]
+    end_date: Optional[str]
+    status: str
+    progress: float
+    error: Optional[str]
+    created_at: datetime
+    finished_at: Optional[datetime]
+    download_url: Optional[str]
@@ -0,0 +1,143 @@
+# scripts/bench_indexes.py
+"""Benchmark the serving-log analytics queries with and without the 0001 migration indexes.
+
+Seeds a throwaway SQLite database with a large serving history, then prints the query
+plan and the mean time of each query before and after creating the indexes:
+
+    python scripts/bench_indexes.py --rows 1000000 --runs 5
+
+Reference runs on 1M rows with SQLite 3.40, mean of 5 runs, before -> after:
+
+    served today, date(timestamp) = ?    175-200 ms -> 160-165 ms  (index on status only)
+    served today, half-open range        120-125 ms -> 0.1 ms      (status, timestamp range)
+    30-day popularity GROUP BY meal_id   125-135 ms -> 55-75 ms    (skip-scan of meal_id, timestamp)
+
+The popularity search still reads each of the ~41k rows in the window from the table for
+status and portions, so the index saves about half of the time, not more.
+"""
+from datetime import datetime, timedelta
+import argparse
+import importlib.util
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATION = os.path.join(ROOT, "alembic", "versions", "0001_serving_log_indexes.py")
+MEALS = 50
+USERS = 5
+DAYS = 730
+BATCH = 50_000
+
+# (label, SQL); parameters are filled from the benchmark's "now"
+QUERIES = [
+    ("served today, date(timestamp) = ?",
+     "SELECT coalesce(sum(portions), 0) FROM serving_logs "
+     "WHERE status = 'success' AND date(timestamp) = :day"),
+    ("served today, half-open range",
+     "SELECT coalesce(sum(portions), 0) FROM serving_logs "
+     "WHERE status = 'success' AND timestamp >= :day_start AND timestamp < :day_end"),
+    ("30-day popularity GROUP BY meal_id",
+     "SELECT meal_id, sum(portions) FROM serving_logs "
+     "WHERE status = 'success' AND timestamp >= :month_start GROUP BY meal_id"),
+]
+
+
+def load_indexes() -> list:
+    """The (name, table, columns) list of the migration, so the benchmark follows it."""
+    spec = importlib.util.spec_from_file_location("serving_log_indexes", MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    return migration.INDEXES
+
+
+def create_schema(path: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    sys.path.insert(0, ROOT)
+    from database import Base, engine
+    import models  # noqa: F401  registers the tables
+
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+
+def seed(connection: sqlite3.Connection, rows: int, now: datetime):
+    random.seed(42)
+    connection.executemany(
+        "INSERT INTO users (id, name, email, hashed_password, role, status) VALUES (?, ?, ?, 'x', 'cook', 'active')",
+        [(user_id, f"Cook {user_id}", f"cook{user_id}@example.com") for user_id in range(1, USERS + 1)]
+    )
+    connection.executemany(
+        "INSERT INTO meals (id, name, description, category, servings, preparation_time) "
+        "VALUES (?, ?, '', 'lunch', 1, 10)",
+        [(meal_id, f"Meal {meal_id}") for meal_id in range(1, MEALS + 1)]
+    )
+    start = now - timedelta(days=DAYS)
+    span = DAYS * 24 * 3600
+    for offset in range(0, rows, BATCH):
+        connection.executemany(
+            "INSERT INTO serving_logs (meal_id, user_id, portions, status, timestamp) VALUES (?, ?, ?, ?, ?)",
+            [
+                (random.randint(1, MEALS), random.randint(1, USERS), random.randint(1, 30),
+                 "success" if random.random() < 0.9 else "failed",
+                 (start + timedelta(seconds=random.randrange(span))).strftime("%Y-%m-%d %H:%M:%S.%f"))
+                for _ in range(min(BATCH, rows - offset))
+            ]
+        )
+    connection.commit()
+
+
+def run_queries(connection: sqlite3.Connection, params: dict, runs: int, label: str):
+    print(f"\n== {label}")
+    for name, sql in QUERIES:
+        plan = [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            connection.execute(sql, params).fetchall()
+            timings.append(time.perf_counter() - started)
+        print(f"{name:38} {sum(timings) / runs * 1000:9.1f} ms  {' / '.join(plan)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="serving_logs rows to seed")
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per query")
+    parser.add_argument("--db", help="SQLite file to create (default: a temporary file)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    if os.path.exists(path):
+        sys.exit(f"{path} already exists")
+    create_schema(path)
+    indexes = load_indexes()
+
+    connection = sqlite3.connect(path)
+    for name, _, _ in indexes:
+        connection.execute(f"DROP INDEX IF EXISTS {name}")
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    seed(connection, args.rows, now)
+    print(f"Seeded {args.rows} serving_logs rows into {path} in {time.perf_counter() - started:.1f} s")
+
+    day_start = datetime(now.year, now.month, now.day)
+    params = {
+        "day": day_start.strftime("%Y-%m-%d"),
+        "day_start": day_start.strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "day_end": (day_start + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "month_start": (day_start - timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S.%f"),
+    }
+    connection.execute("ANALYZE")
+    run_queries(connection, params, args.runs, "without the 0001 indexes")
+    for name, table, columns in indexes:
+        connection.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+    connection.execute("ANALYZE")
+    run_queries(connection, params, args.runs, "with the 0001 indexes")
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+# The modules read DATABASE_URL on import, so point them at a throwaway SQLite file first
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
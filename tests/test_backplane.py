@@ -0,0 +1,92 @@
+# tests/test_backplane.py
+import asyncio
+
+import pytest
+
+from backplane import Backplane, BackplaneUnavailable, RedisBackplane
+from websocket_manager import ConnectionManager, IngredientDeltaStream
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def test_backplane_is_abstract():
+    with pytest.raises(TypeError):
+        Backplane()
+
+
+async def _wait_for(received: list, count: int):
+    for _ in range(100):
+        if len(received) >= count:
+            return
+        await asyncio.sleep(0.02)
+
+
+def test_redis_backplanes_deliver_across_workers():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        received = {"a": [], "b": []}
+
+        def handler(name):
+            async def handle(envelope):
+                received[name].append(envelope)
+            return handle
+
+        workers = {name: RedisBackplane(client=fakeredis.FakeAsyncRedis(server=server)) for name in received}
+        for name, worker in workers.items():
+            await worker.start(handler(name))
+        try:
+            await workers["a"].publish({"topics": ["servings"], "message": "from a"})
+            await workers["b"].publish({"topics": ["ingredients"], "message": "from b"})
+            await _wait_for(received["a"], 2)
+            await _wait_for(received["b"], 2)
+            sequences = [await workers["a"].next_sequence(), await workers["b"].next_sequence()]
+            current = await workers["a"].current_sequence()
+        finally:
+            for worker in workers.values():
+                await worker.close()
+        return received, sequences, current
+
+    received, sequences, current = asyncio.run(scenario())
+    # Each worker gets its own event once (locally) and the other worker's once (through Redis)
+    for name in ("a", "b"):
+        assert sorted(envelope["message"] for envelope in received[name]) == ["from a", "from b"]
+        assert all("origin" not in envelope for envelope in received[name])
+    assert sequences == [1, 2]
+    assert current == 2
+
+
+def test_delta_stream_keeps_changes_while_redis_is_down():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        backplane = RedisBackplane(client=fakeredis.FakeAsyncRedis(server=server))
+        manager = ConnectionManager(backplane=backplane)
+        published = []
+
+        async def load_levels(ingredient_ids):
+            return [(ingredient_id, 5.0, 1.0) for ingredient_id in ingredient_ids]
+
+        async def publish(topics, message):
+            published.append(message)
+
+        manager.publish = publish
+        await manager.start()
+        deltas = IngredientDeltaStream(manager, load_levels)
+        try:
+            server.connected = False
+            with pytest.raises(BackplaneUnavailable):
+                await backplane.current_sequence()
+            deltas.note([1, 2])
+            await deltas.flush()
+            kept = set(deltas.pending)
+
+            server.connected = True
+            await deltas.flush()
+        finally:
+            await deltas.shutdown()
+            await manager.shutdown()
+        return kept, published
+
+    kept, published = asyncio.run(scenario())
+    assert kept == {1, 2}
+    assert len(published) == 1
+    assert published[0]["changes"] == [[1, 5.0], [2, 5.0]]
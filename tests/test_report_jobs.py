@@ -0,0 +1,47 @@
+# tests/test_report_jobs.py
+import os
+import time
+
+import pytest
+
+from database import Base, engine
+from report_jobs import RedisReportJobStore, ReportJobQueue
+from schemas import ReportJobCreate
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def _wait_done(queue: ReportJobQueue, job_id: str):
+    for _ in range(250):
+        job = queue.get(job_id)
+        if job is not None and job.finished:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Report job {job_id} did not finish")
+
+
+def test_redis_store_shares_jobs_between_workers(tmp_path):
+    Base.metadata.create_all(bind=engine)
+    server = fakeredis.FakeServer()
+    workers = [
+        ReportJobQueue(directory=str(tmp_path), workers=1, max_jobs=2,
+                       store=RedisReportJobStore(client=fakeredis.FakeRedis(server=server)))
+        for _ in range(2)
+    ]
+    params = ReportJobCreate(report="inventory", format="csv")
+    try:
+        job = workers[0].submit(params, "fingerprint-1")
+        # The other worker sees the job, its progress and its artifact
+        done = _wait_done(workers[1], job.id)
+        assert done.status == "done" and os.path.exists(done.path)
+        assert workers[1].submit(params, "fingerprint-1").id == job.id
+
+        # Beyond max_jobs the oldest finished job is evicted for every worker
+        for fingerprint in ("fingerprint-2", "fingerprint-3"):
+            _wait_done(workers[1], workers[1].submit(params, fingerprint).id)
+        assert workers[0].get(job.id) is None
+        assert not os.path.exists(job.path)
+        assert workers[0].submit(params, "fingerprint-1").id != job.id
+    finally:
+        for worker in workers:
+            worker.executor.shutdown(wait=True)
@@ -0,0 +1,77 @@
+# tests/test_serving_concurrency.py
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import math
+
+import pytest
+
+from database import Base, SessionLocal, engine
+from models import Ingredient, Meal, MealIngredient, User
+from schemas import ServingCreate
+from crud import serve_meal_db, serve_meals_batch_db
+
+THREADS = 50
+STOCK = 25.0
+NEEDED = 2.0
+
+
+@pytest.fixture
+def meal():
+    """A meal whose only ingredient has stock for floor(STOCK / NEEDED) portions."""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = User(name="Cook", email=f"cook-{datetime.now().timestamp()}@example.com", hashed_password="x")
+    ingredient = Ingredient(name="rice", quantity=STOCK, unit="kg", threshold=1, category="grains", cost=1,
+                            delivery_date=datetime.now(timezone.utc))
+    db.add_all([user, ingredient])
+    db.flush()
+    db_meal = Meal(name="Rice", description="", category="lunch", servings=1, preparation_time=5)
+    db.add(db_meal)
+    db.flush()
+    db.add(MealIngredient(meal_id=db_meal.id, ingredient_id=ingredient.id, quantity=NEEDED, unit="kg"))
+    db.commit()
+    ids = (db_meal.id, ingredient.id, user.id)
+    db.close()
+    return ids
+
+
+def _serve(serve, *args):
+    db = SessionLocal()
+    try:
+        return serve(db, *args)
+    finally:
+        db.close()
+
+
+def _stock(ingredient_id: int) -> float:
+    db = SessionLocal()
+    try:
+        return db.get(Ingredient, ingredient_id).quantity
+    finally:
+        db.close()
+
+
+def test_concurrent_servings_never_oversell(meal):
+    meal_id, ingredient_id, user_id = meal
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(
+            lambda _: _serve(serve_meal_db, ServingCreate(meal_id=meal_id, portions=1), user_id),
+            range(THREADS)
+        ))
+
+    succeeded = [log for log, _ in results if log.status == "success"]
+    assert len(succeeded) == math.floor(STOCK / NEEDED)
+    assert _stock(ingredient_id) == STOCK - len(succeeded) * NEEDED
+    assert _stock(ingredient_id) >= 0
+
+
+def test_concurrent_batches_never_oversell(meal):
+    meal_id, ingredient_id, user_id = meal
+    batch = [ServingCreate(meal_id=meal_id, portions=1)] * 3
+    with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(lambda _: _serve(serve_meals_batch_db, batch, user_id), range(THREADS)))
+
+    portions = sum(log.portions for logs, _ in results for log in logs if log.status == "success")
+    assert portions == math.floor(STOCK / NEEDED)
+    assert _stock(ingredient_id) == STOCK - portions * NEEDED
+    assert _stock(ingredient_id) >= 0
@@ -1,26 +1,333 @@
 # websocket_manager.py
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import List
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+from websockets.exceptions import ConnectionClosed
+
+from backplane import Backplane, BackplaneUnavailable, create_backplane
+
+# Outbound queue settings - each client gets its own bounded queue and writer task
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# "drop_oldest" discards the oldest queued message, "disconnect" closes the slow client
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+
+OVERFLOW_POLICIES = ("drop_oldest", "disconnect")
+
+# What a send raises once the peer is gone; the websockets implementation raises ConnectionClosed
+SEND_ERRORS = (WebSocketDisconnect, RuntimeError, ConnectionError, ConnectionClosed)
+
+# Ingredient quantity changes inside this window are sent as a single delta frame
+WS_COALESCE_WINDOW_MS = int(os.getenv("WS_COALESCE_WINDOW_MS", "100"))
+# Delay before retrying a delta frame while the backplane is unavailable
+WS_DELTA_RETRY_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+# Reads the committed (id, quantity, threshold) of the given ingredients
+LevelsLoader = Callable[[List[int]], Awaitable[List[Tuple[int, float, float]]]]
+
+# Subscription topics - "*" receives every event
+WILDCARD_TOPIC = "*"
+TOPICS = {WILDCARD_TOPIC, "servings", "ingredients", "low_stock", "analytics", "reports"}
+INGREDIENT_TOPIC_PATTERN = re.compile(r"^ingredient:\d+$")
+
+
+def ingredient_topic(ingredient_id: int) -> str:
+    return f"ingredient:{ingredient_id}"
+
+
+def is_valid_topic(topic: Any) -> bool:
+    # Topics come straight from client JSON, so anything but a string is rejected
+    return isinstance(topic, str) and (topic in TOPICS or bool(INGREDIENT_TOPIC_PATTERN.match(topic)))
+
+
+class ClientConnection:
+    """A connected socket with its own bounded send queue and writer task."""
+
+    def __init__(self, websocket: WebSocket, queue_size: int, overflow_policy: str):
+        self.websocket = websocket
+        self.overflow_policy = overflow_policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer_task: Optional[asyncio.Task] = None
+        self.topics: Set[str] = set()
+        self.connected_at = time.monotonic()
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.sending_since: Optional[float] = None
+
+    def enqueue(self, message: str) -> bool:
+        """Queue a message without waiting. Returns False if the client should be disconnected."""
+        item = (time.monotonic(), message)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.overflow_policy == "disconnect":
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(item)
+        return True
+
+    async def run_writer(self):
+        """Drain the queue into the socket until the connection goes away."""
+        try:
+            while True:
+                enqueued_at, message = await self.queue.get()
+                self.sending_since = time.monotonic()
+                await self.websocket.send_text(message)
+                finished_at = time.monotonic()
+                self.sending_since = None
+                self.sent += 1
+                self.last_lag = finished_at - enqueued_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+        except SEND_ERRORS:
+            # Connection closed or error, the manager drops the client
+            pass
+        except Exception:
+            # Still ends the connection through the done callback, but never unnoticed
+            logger.exception("WebSocket writer failed")
+        finally:
+            self.sending_since = None
+
+    def metrics(self) -> Dict[str, Any]:
+        client = self.websocket.client
+        stalled_for = time.monotonic() - self.sending_since if self.sending_since else 0.0
+        return {
+            "client": f"{client.host}:{client.port}" if client else None,
+            "connected_for_s": round(time.monotonic() - self.connected_at, 1),
+            "topics": sorted(self.topics),
+            "queue_depth": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "last_lag_ms": round(self.last_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "stalled_ms": round(stalled_for * 1000, 2),
+        }
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, overflow_policy: str = WS_OVERFLOW_POLICY,
+                 backplane: Optional[Backplane] = None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy!r}, expected one of {OVERFLOW_POLICIES}")
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        # Published events go through the backplane so sockets held by other workers get them too
+        self.backplane = backplane or create_backplane()
+        self._backplane_started = False
+        self._backplane_lock = asyncio.Lock()
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        # Topic -> subscribed sockets, so an event only reaches the clients that asked for it
+        self.subscriptions: Dict[str, Set[WebSocket]] = {}
+        self.disconnected_slow_clients = 0
 
-    async def connect(self, websocket: WebSocket):
+    async def start(self):
+        async with self._backplane_lock:
+            if not self._backplane_started:
+                await self.backplane.start(self._receive)
+                self._backplane_started = True
+
+    async def connect(self, websocket: WebSocket, topics: Iterable[str] = (WILDCARD_TOPIC,)):
+        await self.start()
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = ClientConnection(websocket, self.queue_size, self.overflow_policy)
+        client.writer_task = asyncio.create_task(client.run_writer())
+        client.writer_task.add_done_callback(lambda _task: self.disconnect(websocket))
+        self.active_connections[websocket] = client
+        self.subscribe(websocket, topics)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        client = self.active_connections.pop(websocket, None)
+        if client is None:
+            return
+        self.unsubscribe(websocket, list(client.topics), client=client)
+        if client.writer_task and not client.writer_task.done():
+            client.writer_task.cancel()
 
-    @staticmethod
-    async def send_personal_message(message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        """Subscribe a socket to topics. Returns the topics that were rejected as unknown."""
+        client = self.active_connections.get(websocket)
+        rejected = []
+        for topic in topics:
+            if client is None or not is_valid_topic(topic):
+                rejected.append(topic)
+                continue
+            client.topics.add(topic)
+            self.subscriptions.setdefault(topic, set()).add(websocket)
+        return rejected
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str],
+                    client: Optional[ClientConnection] = None) -> List[str]:
+        """Unsubscribe a socket from topics. Returns the topics that were rejected as unknown."""
+        client = client or self.active_connections.get(websocket)
+        rejected = []
+        for topic in topics:
+            if not is_valid_topic(topic):
+                rejected.append(topic)
+                continue
+            if client is not None:
+                client.topics.discard(topic)
+            subscribers = self.subscriptions.get(topic)
+            if subscribers is not None:
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self.subscriptions[topic]
+        return rejected
+
+    async def send_personal_message(self, message: str, websocket: WebSocket):
+        client = self.active_connections.get(websocket)
+        if client is None:
+            await websocket.send_text(message)
+        elif not client.enqueue(message):
+            self._drop_slow_client(client)
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except (WebSocketDisconnect, RuntimeError):
-                # Connection closed or error, remove it
-                self.active_connections.remove(connection)
\ No newline at end of file
+        """Queue a message for every client on every worker."""
+        await self.publish([WILDCARD_TOPIC], message)
+
+    async def publish(self, topics: Iterable[str], message: Union[str, Dict[str, Any]]):
+        """Serialize an event once and send it to every socket subscribed to any of the topics."""
+        if not isinstance(message, str):
+            message = json.dumps(message)
+        await self.start()
+        await self.backplane.publish({"topics": list(topics), "message": message})
+
+    async def _receive(self, envelope: Dict[str, Any]):
+        """Queue an envelope from the backplane for the local subscribers, without waiting on sockets."""
+        topics = envelope["topics"]
+        if WILDCARD_TOPIC in topics:
+            recipients = list(self.active_connections)
+        else:
+            recipients = set(self.subscriptions.get(WILDCARD_TOPIC, ()))
+            for topic in topics:
+                recipients.update(self.subscriptions.get(topic, ()))
+        self._deliver(recipients, envelope["message"])
+
+    def _deliver(self, websockets: Iterable[WebSocket], message: str):
+        slow_clients = []
+        for websocket in websockets:
+            client = self.active_connections.get(websocket)
+            if client is not None and not client.enqueue(message):
+                slow_clients.append(client)
+        for client in slow_clients:
+            self._drop_slow_client(client)
+
+    def _drop_slow_client(self, client: ClientConnection):
+        self.disconnected_slow_clients += 1
+        self.disconnect(client.websocket)
+        # Closing may itself block on a stuck socket, so never await it here
+        asyncio.create_task(self._close_quietly(client.websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except SEND_ERRORS:
+            pass
+
+    async def shutdown(self):
+        for websocket in list(self.active_connections):
+            self.disconnect(websocket)
+        await self.backplane.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        clients: List[Dict[str, Any]] = [client.metrics() for client in self.active_connections.values()]
+        return {
+            "connections": len(clients),
+            "queue_size": self.queue_size,
+            "overflow_policy": self.overflow_policy,
+            "backplane": type(self.backplane).__name__,
+            "total_dropped": sum(client["dropped"] for client in clients),
+            "disconnected_slow_clients": self.disconnected_slow_clients,
+            "subscriptions": {topic: len(sockets) for topic, sockets in self.subscriptions.items()},
+            "clients": clients,
+        }
+
+
+class IngredientDeltaStream:
+    """Coalesces ingredient quantity changes into one numbered delta frame per window.
+
+    Frames look like {"type": "ingredient_delta", "seq": 7, "changes": [[id, quantity], ...],
+    "low_stock": [id, ...]} and carry absolute quantities, so replaying one is harmless.
+    A reconnecting client asks for a snapshot, which is stamped with the last seq sent,
+    then applies any delta with a higher seq. Sequence numbers come from the backplane,
+    so they are shared by all workers.
+
+    Writers only note which ingredients changed, after committing; a flush reads their
+    committed quantities. Concurrent writers may note in any order, and the frame still
+    never carries a quantity older than the last note before it.
+    """
+
+    def __init__(self, manager: ConnectionManager, load_levels: LevelsLoader,
+                 window_ms: int = WS_COALESCE_WINDOW_MS):
+        self.manager = manager
+        self.load_levels = load_levels
+        self.window = window_ms / 1000
+        self.pending: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def note(self, ingredient_ids: Iterable[int]):
+        """Record that the quantities of ingredients changed; call it after the change is committed."""
+        self.pending.update(ingredient_ids)
+        if self.pending:
+            self._schedule(self.window)
+
+    def _schedule(self, delay: float):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay: float):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, set()
+        # Deleted ingredients are simply missing here
+        levels = await self.load_levels(sorted(pending))
+        if not levels:
+            return
+        try:
+            seq = await self.manager.backplane.next_sequence()
+        except BackplaneUnavailable:
+            # Already logged by the backplane; the ingredients go out with a later frame
+            self.pending |= pending
+            self._schedule(WS_DELTA_RETRY_SECONDS)
+            return
+        low_stock = [ingredient_id for ingredient_id, quantity, threshold in levels if quantity <= threshold]
+        topics = ["ingredients"] + [ingredient_topic(ingredient_id) for ingredient_id, _, _ in levels]
+        if low_stock:
+            topics.append("low_stock")
+        await self.manager.publish(topics, {
+            "type": "ingredient_delta",
+            "seq": seq,
+            "changes": [[ingredient_id, quantity] for ingredient_id, quantity, _ in levels],
+            "low_stock": low_stock,
+        })
+
+    async def current_sequence(self) -> int:
+        await self.manager.start()
+        return await self.manager.backplane.current_sequence()
+
+    def _cancel_flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    async def shutdown(self):
+        self._cancel_flush()
+        await self.flush()
+        # A failed last flush schedules a retry, which must not outlive the loop
+        self._cancel_flush()